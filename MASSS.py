@@ -8,26 +8,72 @@
 
 import sys
 import os.path
+import argparse
+import threading
+import signal
 from time import monotonic as time
 import UI
+from library import LibraryIndex
+from watcher import SoundsWatcher
+from metadata import MetadataCache
+import mixer
 import asyncio as aio
-from instances import VlcInstance, port_increment
+import shlex
+from instances import VlcInstance, FakeVlcInstance
+from pool import InstancePool
+from metrics import REGISTRY, MetricsServer, JsonDumper
+from tracer import TRACER, current_press
+from control import Controller, ControlServer
+from libvlc_instances import LibVlcInstance, get_libvlc
 
 #### credits
 # original ASSS from Hugh Tebby's github  ( (c) 2010 )
 # scrollable frame copied from from https://stackoverflow.com/questions/40526496/vertical-scrollbar-for-frame-in-tkinter-python
 
 #### TODO
-# weird misbehave when changing everything in a row ("speedrun glitch") (is it fixed now?)
 # real time vlc crash detection?
 # make a more coherent (and understandable) command line output
 
 
 # ### file playback control classes
 
+SPAWN_BACKOFF = 0.5  # seconds before retrying the background spawns after a failed one (doubled each time)
+MAX_SPAWN_BACKOFF = 30.0
+
+# the available playback backends (selected with --backend)
+BACKENDS = {
+    'rc': VlcInstance,  # one `vlc -I rc` process per instance
+    'libvlc': LibVlcInstance,  # media players inside the MASSS process (needs python-vlc)
+    'fake': FakeVlcInstance,  # fakevlc.py processes: no audio, for tests and measures
+}
+
+# health measures (see metrics.py). the pool sizes are gauges, read from the VlcInterface when scraped
+SPAWNED = REGISTRY.counter('masss_instances_spawned', 'instances created')
+SPAWN_FAILED = REGISTRY.counter('masss_instances_spawn_failed', 'instances which failed to start')
+KILLED = REGISTRY.counter('masss_instances_terminated', 'instances terminated, by reason', ['reason'])
+BROKEN = REGISTRY.counter('masss_instances_broken', 'instances found crashed or unreachable')
+SPAWN_SECONDS = REGISTRY.histogram('masss_spawn_seconds', 'time for a new instance to be ready to play')
+PRESSES = REGISTRY.counter('masss_presses', 'tracks asked to play, by outcome', ['outcome'])
+PRESS_SECONDS = REGISTRY.histogram('masss_press_seconds', 'time from play() to the track being sent to its player, '
+                                   'by path (idle instance, wait for a new one, mixer)', ['path'])
+
+class HotSound:
+    """a sound kept ready to play: it has its own instance, with the track already loaded and paused at its start"""
+    def __init__(self, path, skip):
+        self.path = path
+        self.skip = skip
+        self.inst = None  # started once the first cue is done
+        self.is_cued = False  # the instance is ready to play the track
+        self.is_cueing = False
+
 class VlcInterface:  # a proper communicaiton interface with vlc. manages all the commands
-    def __init__(self):
+    def __init__(self, min_idle=2, max_idle=4, max_total=32, instance_class=VlcInstance,
+                 max_spawning=8, eq_debounce=0.3, max_hot=8):
         # variable initialization
+        if not 0 <= min_idle <= max_idle <= max_total:
+            raise ValueError('pool sizes must satisfy 0 <= min_idle <= max_idle <= max_total')
+        if max_spawning < 1:
+            raise ValueError('max_spawning must be at least 1')
 
         # event loop stuff
         self.loop = aio.get_event_loop()
@@ -37,187 +83,605 @@ class VlcInterface:  # a proper communicaiton interface with vlc. manages all th
         self.eq_cache = ' ' + 10* '0 '
         self.skip_override = None
         self.vol_cache=0.5
-        self.port = 8990
+        self.metadata = None  # a metadata.MetadataCache, for the track lengths
+        self.mixer = None  # a mixer.Mixer, for the short sounds
+        self.mixer_voices = {}  # id -> MixerVoice. (their ids are ('mixer', n), those of the instances are Handles)
+        self.mixer_count = 0
+
+        # hot sounds: they don't use the pool (nor count in max_total), but at most max_hot of them exist
+        self.max_hot = max_hot
+        self.hot = {}  # path -> HotSound
+        self.hot_voices = {}  # id -> instance of a HotSound. (their ids are ('hot', n))
+        self.hot_count = 0
+        self.on_hot = None  # called with (path, is_hot) when a sound becomes hot, or stops being hot
 
         # instance managment and cleaning
-        self.instances = []
+        self.pool = InstancePool()  # the started instances
         self.old_instances = []
         self.broken_instances = []
         self.loading_instances = []
         self.cleaningtasks = []
 
+        # pool sizing
+        self.min_idle = min_idle  # idle instances kept ready (refilled in the background)
+        self.max_idle = max_idle  # idle instances above this number get terminated
+        self.max_total = max_total  # hard cap for playing+idle+loading instances
+        self.max_spawning = max_spawning  # cap for instances loading at once (in the background)
+        self.instance_class = instance_class  # the playback backend
+
+        # equalizer changes: the dirty instances are replaced one at a time, once the changes settle down
+        self.eq_debounce = eq_debounce  # seconds without any change before rebuilding
+        self.rebuild_token = None
+        self.rebuild_task = None
+
+        # failed spawns: the background ones are retried later and later (see spawn_failed)
+        self.spawn_failures = 0  # in a row
+        self.spawn_backoff_end = 0  # no background spawn before this time
+        self.spawn_retry_token = None
+
+        for name, help, function in [
+                ('masss_pool_instances', 'started instances (idle or playing)', lambda: len(self.pool)),
+                ('masss_pool_idle', 'idle instances', self.pool.count_idle),
+                ('masss_pool_idle_dirty', 'idle instances with an old equalizer', self.pool.count_idle_dirty),
+                ('masss_pool_loading', 'instances being started', lambda: len(self.loading_instances)),
+                ('masss_pool_terminating', 'instances being terminated', lambda: len(self.old_instances)),
+                ('masss_mixer_voices', 'tracks played by the mixer', lambda: len(self.mixer_voices)),
+                ('masss_hot_sounds', 'hot sounds', lambda: len(self.hot)),
+                ('masss_hot_cued', 'hot sounds ready to play', lambda: sum(hot.is_cued for hot in self.hot.values()))]:
+            REGISTRY.gauge(name, help, function=function)
+
     # ## instance control methods
 
     def vol(self, v=None):
         """sets the VlcInstances's volumes according to the master volume `v`"""
         if v is not None:
             self.vol_cache = v
-        for inst in self.instances:
-            if inst is not None:
+        for inst in list(self.pool) + self.hot_instances():
+            try:
                 inst.vol(self.vol_cache)
+            except OSError:  # broken pipe: it can't be talked to anymore
+                self.drop_broken(inst)
+        if self.mixer is not None:
+            self.mixer.vol(self.vol_cache)
 
     def set_vol_mod(self, id, v):
-        """sets the volume modifier of a VlcInstance, and updates its real volume accordingly"""
-        self.instances[id].vol_modifier = v
-        self.instances[id].vol()
+        """sets the volume modifier of a voice, and updates its real volume accordingly"""
+        inst = self.mixer_voices.get(id) or self.hot_voices.get(id) or self.pool.get(id)
+        if inst is None:
+            return  # the track is over
+        inst.vol_modifier = v
+        try:
+            inst.vol()
+        except OSError:
+            self.drop_broken(inst)
 
     def eq(self, str):
-        """changes the global equalizer. Note: this will only take effect on new songs, and the VLcInstances need to be rebooted"""
+        """changes the global equalizer. the instances which can apply it live (libvlc backend) do so right away.
+        the others (rc backend) need to be rebooted: this will only take effect on new songs"""
         self.eq_cache = str
-        for inst in self.instances:
-            inst.is_dirty = True
-        self.add_task(self.clean__comb())
-
-    async def play(self, filename, skip=None, on_stop=(lambda:None)):
-        """makes one track play. selects the right VlcInstance for that."""
+        if self.mixer is not None:
+            self.mixer.set_eq(str)
+        need_reboot = False
+        for inst in list(self.pool) + self.loading_instances:
+            if not inst.set_eq(str):
+                inst.is_dirty = True
+                self.pool.mark_dirty(inst)
+                need_reboot = True
+        for hot in self.hot.values():
+            if hot.inst is not None and not hot.inst.set_eq(str):
+                hot.inst.is_dirty = True
+                if hot.is_cued:  # replace it now. (the playing ones are replaced once they stop)
+                    hot.is_cued = False
+                    self.add_task(self.clean__cue(hot))
+        if need_reboot:
+            # coalesce the changes (dragging several bars in a row): wait for them to settle down
+            if self.rebuild_token is not None:
+                self.rebuild_token.cancel()
+            self.rebuild_token = self.loop.call_later(self.eq_debounce, self.start_rebuild)
+
+    async def play(self, filename, skip=None, on_stop=(lambda:None), press_id=None):
+        """makes one track play. selects the right VlcInstance for that.
+        returns the handle of the voice (for stop and set_vol_mod), or None if the pool is exhausted.
+        `press_id` identifies the press in the trace (see tracer.py)"""
+        if press_id is not None:
+            current_press.set(press_id)  # for the rest of this task
+        with TRACER.span('play', file=os.path.basename(filename)):
+            return await self.play_voice(filename, skip, on_stop)
+
+    async def play_voice(self, filename, skip, on_stop):
         if self.skip_override is not None:
             skip = self.skip_override
-        i=0
-        while i<len(self.instances):
-            if self.instances[i] is not None and \
-                    not self.instances[i].is_playing:
-                try:
-                    await self.instances[i].play(filename, skip, on_stop)
-                    break
-                except OSError:  # broken pipe. assume dead VLC instance.
-                    self.broken_instances.append(self.instances[i])
-                    self.add_task(self.clean__comb())
-                    self.instances[i] = None
-                    i += 1
-            else:  # if it is an occupied/voided instance
-                i += 1
-        else:  # no free instance: SHOULDN'T HAPPEN, but take care of it here.
-            i = await self.clean__check_initialized()
-            if i is None:
-                i = await self.add_instance(True)
-            await self.instances[i].play(filename, skip, on_stop)
-
-        for j in range(i, len(self.instances)):
-            if self.instances[j] is not None and \
-                    not self.instances[j].is_playing:
+        beg = time()
+
+        length = self.metadata.length(filename) if self.metadata is not None else None
+        hot = self.hot.get(filename)
+        if hot is not None and hot.is_cued and hot.skip == skip:
+            with TRACER.span('hot'):
+                handle = await self.play_hot(hot, on_stop, length)
+            if handle is not None:
+                PRESSES.labels('played').inc()
+                PRESS_SECONDS.labels('hot').observe(time() - beg)
+                return handle
+            # its instance broke: play it from the pool
+
+        if self.mixer is not None and self.mixer.accepts(filename, length):
+            with TRACER.span('mixer'):
+                handle = await self.play_mixer(filename, skip, on_stop)
+            if handle is not None:
+                PRESSES.labels('played').inc()
+                PRESS_SECONDS.labels('mixer').observe(time() - beg)
+                return handle
+            # could not be decoded: vlc will do it
+
+        while True:
+            handle = self.pool.acquire()
+            if handle is None:
                 break
-        else:  # no break happened: no other free instance: create one ASAP.
-            self.add_task(self.clean__refill())
+            inst = self.pool.get(handle)
+            TRACER.instant('instance selected', slot=handle.slot)
+            try:
+                await inst.play(filename, skip, self.track_stopper(inst, on_stop), length)
+                break
+            except OSError:  # broken pipe. assume dead VLC instance.
+                self.drop_broken(inst)
+        path = 'idle'
+        if handle is None:  # no free instance: the burst was bigger than the idle pool.
+            spawn_wait = TRACER.begin('spawn wait')
+            await self.clean__check_initialized()
+            try:
+                if self.pool.count_idle() == 0 and self.loading_instances:
+                    # an instance is already on its way, no need to spawn another one
+                    inst = self.loading_instances.pop(0)
+                    await self.add_instance(inst)
+                elif self.pool.count_idle() == 0:
+                    if self.count_total() >= self.max_total:
+                        print('warning: all {:d} VLC instances are busy, track not played.'.format(self.max_total))
+                        PRESSES.labels('pool_full').inc()
+                        return None
+                    await self.add_instance(True)
+            except OSError:  # the new instance failed to start (the error was printed)
+                print('warning: no VLC instance could be started, track not played.')
+                self.spawn_failed()
+                PRESSES.labels('spawn_failed').inc()
+                return None
+            finally:
+                TRACER.end(spawn_wait)
+            handle = self.pool.acquire()
+            inst = self.pool.get(handle)
+            try:
+                await inst.play(filename, skip, self.track_stopper(inst, on_stop), length)
+            except OSError:  # it broke right away
+                print('warning: the new VLC instance broke, track not played.')
+                self.drop_broken(inst)
+                PRESSES.labels('broken').inc()
+                return None
+            path = 'wait'
+        PRESSES.labels('played').inc()
+        if inst.add_time is not None:
+            PRESS_SECONDS.labels(path).observe(inst.add_time - beg)
+
+        # keep the idle pool topped up, in the background
+        self.add_task(self.clean__refill())
+
+        return handle
+
+    def track_stopper(self, inst, on_stop):
+        """the callback for the end of a track played by `inst`"""
+        def on_track_stop():
+            self.pool.release(inst)
+            on_stop()
+            self.clean__after_stop()
+        return on_track_stop
+
+    async def play_hot(self, hot, on_stop, length):
+        """resumes the cued track of a hot sound. returns its id, or None if its instance is broken"""
+        self.hot_count += 1
+        i = ('hot', self.hot_count)
+        inst = hot.inst
+        hot.is_cued = False
+
+        def on_hot_stop():
+            self.hot_voices.pop(i, None)
+            on_stop()
+            self.add_task(self.clean__cue(hot))  # ready for the next press
+
+        self.hot_voices[i] = inst
+        try:
+            await inst.resume(on_hot_stop, length)
+        except OSError:
+            del self.hot_voices[i]
+            self.drop_hot_instance(inst)
+            return None
+        return i
+
+    async def play_mixer(self, filename, skip, on_stop):
+        """plays a short track with the mixer. returns its id, or None if the mixer can't play it"""
+        self.mixer_count += 1
+        i = ('mixer', self.mixer_count)
 
+        def on_voice_stop():
+            on_stop()
+            self.mixer_voices.pop(i, None)
 
+        voice = await self.mixer.play(filename, skip, on_voice_stop)
+        if voice is None:
+            return None
+        self.mixer_voices[i] = voice
         return i
 
     def stop(self, id):
         print('stop inst', id)
+        if id in self.mixer_voices:
+            self.mixer_voices[id].stop()
+            return
+        if id in self.hot_voices:
+            inst = self.hot_voices[id]
+            try:
+                inst.stop()  # it gets cued again
+            except OSError:
+                del self.hot_voices[id]
+                self.drop_hot_instance(inst)
+            return
+        inst = self.pool.get(id)
+        if inst is None:  # stale handle: that track is already over
+            return
         try:
-            self.instances[id].stop()
-            if self.instances[id].is_dirty:
-                self.add_task(self.clean__comb())
+            inst.stop()  # clean__after_stop will be called
         except OSError:  # something crashed... not tat it matters right now
-            self.broken_instances.append(self.instances[id])
-            self.instances[id].on_close()  # finalize stuff in the instance's stead
-            self.instances[id] = None
-            self.add_task(self.clean__comb())
+            self.drop_broken(inst)
+
+    def drop_broken(self, inst):
+        """an instance (of the pool, or of a hot sound) can't be talked to anymore: it is replaced"""
+        if inst not in self.pool:
+            self.drop_hot_instance(inst)
+            return
+        BROKEN.inc()
+        self.pool.remove(inst)
+        self.broken_instances.append(inst)
+        self.add_task(self.clean__comb())
+
+    # ## hot sounds
+    def set_hot(self, path, skip, is_hot):
+        """makes a sound hot (or not). returns whether it is hot now: there can't be more than max_hot of them"""
+        if not is_hot:
+            hot = self.hot.pop(path, None)
+            if hot is None:
+                return False
+            if hot.inst is not None and not hot.is_cueing and hot.inst not in self.hot_voices.values():
+                self.retire(hot.inst)  # (the others are retired once they stop, or are cued: see clean__cue)
+                hot.inst = None
+        elif path not in self.hot:
+            if len(self.hot) >= self.max_hot:
+                print('warning: there are already {:d} hot sounds.'.format(self.max_hot))
+                return False
+            hot = self.hot[path] = HotSound(path, skip)
+            self.add_task(self.clean__cue(hot))
+        else:
+            return True
+        if self.on_hot is not None:
+            self.on_hot(path, is_hot)
+        return is_hot
+
+    def unset_hot(self, hot):
+        if self.hot.get(hot.path) is hot:
+            self.set_hot(hot.path, hot.skip, False)
+
+    def hot_instances(self):
+        return [hot.inst for hot in self.hot.values() if hot.inst is not None] + \
+               [inst for inst in self.hot_voices.values() if not any(hot.inst is inst for hot in self.hot.values())]
+
+    def retire(self, inst):
+        inst.terminate()
+        KILLED.labels('hot').inc()
+        self.old_instances.append(inst)
+        self.add_task(self.clean__terminate_old())
+
+    def drop_hot_instance(self, inst):
+        """the instance of a hot sound is broken: it is replaced"""
+        for id in [id for id, voice in self.hot_voices.items() if voice is inst]:
+            del self.hot_voices[id]
+        BROKEN.inc()
+        self.broken_instances.append(inst)
+        self.add_task(self.clean__comb())
+        for hot in self.hot.values():
+            if hot.inst is inst:
+                hot.inst = None
+                hot.is_cued = False
+                self.add_task(self.clean__cue(hot))
+
+    async def clean__cue(self, hot):
+        """gets a hot sound ready to play: (re)starts its instance if needed, and cues its track"""
+        if hot.is_cueing:
+            return
+        if self.hot.get(hot.path) is not hot:  # not hot anymore
+            if hot.inst is not None:
+                self.retire(hot.inst)
+                hot.inst = None
+            return
+        if self.is_terminated or hot.is_cued:
+            return
+        hot.is_cueing = True
+        try:
+            if hot.inst is not None and hot.inst.is_dirty:  # old equalizer
+                self.retire(hot.inst)
+                hot.inst = None
+            elif hot.inst is not None and hot.inst.is_cleanable():  # it crashed (it terminated itself)
+                BROKEN.inc()
+                KILLED.labels('broken').inc()
+                self.old_instances.append(hot.inst)
+                hot.inst = None
+            if hot.inst is None:
+                inst = self.new_instance()
+                if inst.start_task is not None:
+                    await aio.wait([inst.start_task])  # (doesn't raise if it failed)
+                    if inst.start_task is not None:  # it failed to start (the error was printed)
+                        self.spawn_failed()
+                        self.unset_hot(hot)
+                        return
+                if self.is_terminated:  # too late
+                    self.retire(inst)
+                    return
+                self.spawn_succeeded(inst)
+                hot.inst = inst
+            await hot.inst.cue(hot.path, hot.skip)
+        except OSError as err:  # broken, or the track could not be opened
+            print('warning: could not cue', hot.path, ':', err)
+            inst, hot.inst = hot.inst, None
+            if inst is not None:
+                BROKEN.inc()
+                self.broken_instances.append(inst)
+                self.add_task(self.clean__comb())
+            self.unset_hot(hot)  # the next press will use the pool
+            return
+        finally:
+            hot.is_cueing = False
+        if self.hot.get(hot.path) is not hot:  # not hot anymore
+            self.add_task(self.clean__cue(hot))
+        else:
+            hot.is_cued = True
 
     # ## instance management and cleaning methods
 
+    def call(self, function, *args):
+        """calls function(*args) in the event loop's thread. this is how the UI (in Tk's thread) controls the interface"""
+        self.loop.call_soon_threadsafe(function, *args)
+
     def add_task(self, awaitable):
-        self.cleaningtasks.append(self.loop.create_task(awaitable))
+        task = self.loop.create_task(self.background(awaitable))
+        self.cleaningtasks.append(task)
+        task.add_done_callback(self._remove_task)
+
+    async def background(self, awaitable):
+        # the cleaning tasks are not part of the press which may have started them (see tracer.current_press)
+        current_press.set(None)
+        with TRACER.span(getattr(awaitable, '__name__', 'task')):
+            return await awaitable
+
+    def _remove_task(self, task):
+        if task in self.cleaningtasks:
+            self.cleaningtasks.remove(task)
+
+    def count_idle(self, clean_only=False):
+        """number of started instances that are not playing anything
+        (only counting those with the current equalizer if clean_only)"""
+        return self.pool.count_idle(clean_only)
+
+    def count_total(self):
+        """number of instances, whatever their state (loading instances included)"""
+        return len(self.pool) + len(self.loading_instances)
 
     async def add_instance(self, immediate_instance=False):
         # three uses for immediate_instance:
         # False, True, and the initialized VlcInstance to be added
         if isinstance(immediate_instance, bool):
             # the forst two need the creation of an instance
-            inst = VlcInstance(self.port, self.eq_cache, self.vol_cache,
-                               self.loop)
+            inst = self.new_instance()
         else:
             inst = immediate_instance
         if not immediate_instance:
             # for False only
             self.loading_instances.append(inst)
+            # add it to the pool as soon as it is ready
+            self.add_task(self.clean__wait_started(inst))
         else:
             await inst.ensure_started()  # wait for the instance to fully start
-            self.port = port_increment(inst.port)
-            for i, otherinst in enumerate(self.instances):
-                if otherinst is None:
-                    self.instances[i] = inst
-                    return i
-            else:
-                self.instances.append(inst)
-                return(len(self.instances)-1)
+            self.pool_add(inst)
 
-        # queue a cleaning operation for when this instance will (hopefully) be ready.
-        self.add_task(self.clean__check_initialized(0.2))
+    def new_instance(self):
+        inst = self.instance_class(self.eq_cache, self.vol_cache, self.loop)
+        inst.on_broken = self.on_instance_broken
+        SPAWNED.inc()
+        return inst
 
-    async def clean__check_initialized(self, after=0):
-        """goes through all the instances being initialized, and takes care of the ones which finished."""
-        """return the first which finished if it exists"""
+    def on_instance_broken(self, inst):
+        """an instance found out that it is broken (its vlc crashed): clean__comb replaces it"""
+        self.add_task(self.clean__comb())
 
-        # this method can arrange for a later call of itself.
-        # but it needs to be able to wait for this.
-        await aio.sleep(after)
+    def pool_add(self, inst):
+        """adds a started instance to the pool"""
+        self.spawn_succeeded(inst)
+        self.pool.add(inst)
+
+    def spawn_succeeded(self, inst):
+        if inst.spawn_duration is not None:
+            SPAWN_SECONDS.observe(inst.spawn_duration)
+        self.spawn_failures = 0
+        self.spawn_backoff_end = 0
+
+    def spawn_failed(self):
+        """an instance failed to start. the background spawns wait a bit longer after each failure in a row,
+        so that a missing (or broken) vlc isn't launched again and again"""
+        SPAWN_FAILED.inc()
+        self.spawn_failures += 1
+        delay = min(SPAWN_BACKOFF * 2**(self.spawn_failures-1), MAX_SPAWN_BACKOFF)
+        self.spawn_backoff_end = time() + delay
+        print('warning: {:d} VLC instance(s) failed to start in a row, next try in {:.1f}s'.format(
+            self.spawn_failures, delay))
+        if self.spawn_retry_token is not None:
+            self.spawn_retry_token.cancel()
+        self.spawn_retry_token = self.loop.call_later(delay, self.retry_spawn)
+
+    def retry_spawn(self):
+        self.spawn_retry_token = None
+        self.add_task(self.clean__refill())
 
+    async def clean__wait_started(self, inst):
+        """waits for a loading instance to be ready, and adds it to the pool (unless play() took it meanwhile)"""
+        if inst.start_task is not None:
+            await aio.wait([inst.start_task])  # (doesn't raise if it failed)
+        if inst not in self.loading_instances or self.is_terminated:
+            return
+        if inst.start_task is None:
+            self.loading_instances.remove(inst)
+            self.pool_add(inst)
+            self.add_task(self.clean__refill())  # the next ones, if needed
+        else:  # it failed to start (the error was printed): forget it. (retry_spawn tries again later)
+            self.loading_instances.remove(inst)
+            self.spawn_failed()
+
+    async def clean__check_initialized(self):
+        """goes through all the instances being initialized, and adds the ones which finished to the pool"""
         i = 0
-        first_new_instance_id = None
         while i< len(self.loading_instances):
             inst = self.loading_instances[i]
             if inst.start_task is None:  # if it completed its starting coroutine
-                temp_id = await self.add_instance(inst)
-                if first_new_instance_id is None:
-                    first_new_instance_id = temp_id
-                self.port = port_increment(inst.port)
+                self.pool_add(inst)
+                del self.loading_instances[i]
+            elif inst.start_task.done():  # it failed to start (the error was printed): forget it
                 del self.loading_instances[i]
+                self.spawn_failed()
             else:
                 i += 1
 
-        # queue a re-run if necessary
-        if len(self.loading_instances) > 0:
-            self.add_task(self.clean__check_initialized(0.2))
-
-        return first_new_instance_id
-
 
     async def clean__comb(self, event=None):
         """removes instances that should be cleaned from the main list"""
-        # check for dirty instances that have to be renewed
-        for i in range(len(self.instances)):
+        # check for broken instances that have to be renewed
+        for inst in list(self.pool):
+            try:
+                if inst.is_cleanable():  # (it terminated itself)
+                    BROKEN.inc()
+                    KILLED.labels('broken').inc()
+                    self.old_instances.append(inst)
+                    self.pool.remove(inst)
+            except OSError:
+                # assume this means the instance died.
+                BROKEN.inc()
+                self.broken_instances.append(inst)
+                self.pool.remove(inst)
+        for hot in list(self.hot.values()):
+            if hot.inst is None or hot.is_cueing:
+                continue
             try:
-                if self.instances[i] and self.instances[i].is_cleanable():
-                    self.old_instances.append(self.instances[i])
-                    self.instances[i] = None
+                if not hot.inst.is_cleanable():
+                    continue
+                KILLED.labels('broken').inc()
+                self.old_instances.append(hot.inst)
             except OSError:
-                # assume this means the instance is not None, and died.
-                self.broken_instances.append(self.instances[i])
-                self.instances[i] = None
+                self.broken_instances.append(hot.inst)
+            BROKEN.inc()
+            hot.inst = None
+            hot.is_cued = False
+            self.add_task(self.clean__cue(hot))
         # check for broken instances and deal with them
         for inst in self.broken_instances:
             inst.terminate_broken()
+            KILLED.labels('broken').inc()
         self.old_instances += self.broken_instances
         self.broken_instances = []
 
-        # clean the instance list, because when instances are removed from list, they are raplaced with None
-        for i in range(len(self.instances)-1, -1, -1):
-            if self.instances[i] is None:
-                del self.instances[i]
-            else:
-                break  # only clean the end of the list
-
         # see if anything can be deleted, and if we need more instances
         self.add_task(self.clean__refill())
         self.add_task(self.clean__terminate_old())
 
     async def clean__refill(self, event=None):
-        """create new instances if necessary"""
+        """create or remove instances to keep the idle pool between min_idle and max_idle"""
 
         await self.clean__check_initialized()
+        if self.is_terminated:
+            return
 
-        # ensure at least one available instance
-        for j in range(len(self.instances)):
-            if self.instances[j] is not None and \
-                    not self.instances[j].is_playing:
-                break
-        else:  # no break happened
+        # instances which are loading will be idle soon: count them in
+        idle = self.count_idle()
+        missing = self.min_idle - idle - len(self.loading_instances)
+        missing = min(missing, self.max_total - self.count_total(),
+                      self.max_spawning - len(self.loading_instances))
+        if time() < self.spawn_backoff_end:
+            missing = 0  # the last spawns failed: retry_spawn will come back
+        for _ in range(missing):
             await self.add_instance()
 
+        if idle > self.max_idle:
+            self.clean__trim(idle - self.max_idle)
 
-        #self.cleaningtask = self.window.after(500, self.clean)
-        # cleaning every 0.5s
+    def clean__trim(self, n):
+        """terminate `n` idle instances (the dirty ones first)"""
+        for _ in range(n):
+            inst = self.pool.pop_idle()
+            if inst is None:
+                break
+            inst.terminate()
+            KILLED.labels('trim').inc()
+            self.old_instances.append(inst)
+        self.add_task(self.clean__terminate_old())
+
+    def clean__after_stop(self):
+        """called each time a track stops"""
+        if self.pool.count_idle_dirty():
+            self.start_rebuild()
+        else:
+            self.add_task(self.clean__refill())  # trim the idle pool if needed
+
+    def start_rebuild(self):
+        """starts replacing the dirty instances, unless it is already being done"""
+        self.rebuild_token = None
+        if self.rebuild_task is None or self.rebuild_task.done():
+            self.rebuild_task = self.loop.create_task(self.clean__rebuild())
+            self.cleaningtasks.append(self.rebuild_task)
+
+    async def clean__rebuild(self):
+        """replaces the idle dirty instances (those with an old equalizer), one at a time.
+        a clean idle instance is made ready before a dirty one is retired, unless the pool is at max_total."""
+        while not self.is_terminated:
+            await self.clean__check_initialized()
+            inst = self.pool.first_idle_dirty()
+            if inst is None:
+                dirty_loading = self.loading_tasks(dirty=True)
+                if dirty_loading:
+                    await aio.wait(dirty_loading)  # they will be dirty idle instances soon
+                    continue
+                break  # the playing dirty instances will be handled when they stop
+
+            if self.count_idle(clean_only=True) == 0:
+                clean_loading = self.loading_tasks(dirty=False)
+                if not clean_loading:
+                    if self.count_total() >= self.max_total:
+                        # no room for a clean instance: the dirty one makes room for it
+                        self.retire_dirty(inst)
+                        continue
+                    if len(self.loading_instances) >= self.max_spawning:
+                        await aio.wait(self.loading_tasks(), return_when=aio.FIRST_COMPLETED)
+                        continue
+                    await self.add_instance()
+                    clean_loading = self.loading_tasks(dirty=False)
+                await aio.wait(clean_loading, return_when=aio.FIRST_COMPLETED)  # a clean instance is ready
+                continue
+
+            self.retire_dirty(inst)
+            await self.clean__refill()  # spawn its replacement, if needed
+
+        await self.clean__terminate_old()
+
+    def loading_tasks(self, dirty=None):
+        """the start tasks of the loading instances (only the dirty, or clean, ones if `dirty` is given)"""
+        return [inst.start_task for inst in self.loading_instances
+                if inst.start_task is not None and (dirty is None or inst.is_dirty == dirty)]
+
+    def retire_dirty(self, inst):
+        inst.terminate()
+        KILLED.labels('equalizer').inc()
+        self.old_instances.append(inst)
+        self.pool.remove(inst)
 
     async def clean__terminate_old(self):
         """tries to terminate the abandonned instances (broken or obselete)"""
@@ -229,24 +693,24 @@ class VlcInterface:  # a proper communicaiton interface with vlc. manages all th
                 i+=1
 
     def clean__remove_tasks(self):
-        i=0
-        while i < len(self.cleaningtasks):
-            if self.cleaningtasks[i].done() or self.cleaningtasks[i].cancelled():
-                del self.cleaningtasks[i]
-            i += 1
+        self.cleaningtasks = [task for task in self.cleaningtasks if not task.done()]
 
     # ## quitting methods...
     async def onQuit(self):
         # first, be sure that all the tasks are done
         self.clean__remove_tasks()  # this one is syncronous!
-        for task in self.cleaningtasks:
+        for task in list(self.cleaningtasks):  # (the tasks remove themselves from the list when done)
             await task
 
-        while len(self.instances):
-            if self.instances[0] is not None:
-                self.instances[0].terminate()
-                self.old_instances.append(self.instances[0])
-            del self.instances[0]
+        for inst in list(self.pool) + self.loading_instances + self.hot_instances():
+            inst.terminate()
+            KILLED.labels('quit').inc()
+            self.old_instances.append(inst)
+            self.pool.remove(inst)
+        self.loading_instances = []
+        for hot in self.hot.values():
+            hot.inst = None
+            hot.is_cued = False
 
         await aio.sleep(0.05)
         await self.clean__terminate_old()  # check all instances closed correctly
@@ -271,12 +735,10 @@ class VlcInterface:  # a proper communicaiton interface with vlc. manages all th
             return
         print("starting VlcInterface termination")
         self.is_terminated = True
+        if self.mixer is not None:
+            self.mixer.close()
         # the finalisation should be done cleanly, without sending tasks around.
-        # the tasks that are launched are at most 0.2 seconds long as long as they don't requeue themselves
-
-        # ensure thet they don't requeue
-        self.instances += self.loading_instances
-        self.loading_instances = []
+        # (the tasks don't requeue themselves once is_terminated is set)
 
         # now create the final onQuit task, which will wait for the termination of the other tasks
         self.termination_task = self.loop.create_task(self.onQuit())
@@ -286,36 +748,160 @@ class VlcInterface:  # a proper communicaiton interface with vlc. manages all th
 
 # ### main program
 
-async def mainloop(win, inter):
-    # create the base instance:
-    await inter.clean__refill()
+def run_loop(loop):
+    """the event loop's thread: all of VlcInterface lives here"""
+    aio.set_event_loop(loop)
+    loop.run_forever()
+
+async def finalize(inter, services):
+    for service in services:
+        service.close()
+    if not inter.is_terminated:
+        inter.startFinalization()
+    await inter.termination_task
+    inter.metadata.close()
+
+def mainloop(win, inter, services):
+    # Tk runs in this thread, the event loop in another one: each one sleeps until something happens.
+    # (see UI.Dispatcher and VlcInterface.call for the communication between them)
+    # `services` run in the event loop too (sounds watcher, metrics...): they are closed before the interface
+    inter.add_task(inter.clean__refill())  # create the base instances
+    loop_thread = threading.Thread(target=run_loop, args=(inter.loop,), name='event loop')
+    loop_thread.start()
     try:
-        while not inter.is_terminated:
-            beg = time()
-            inter.clean__remove_tasks()
-            win.update()
-            remaining = beg + 1/60 - time()
-            if remaining > 0:
-                await aio.sleep(remaining)
+        win.mainloop()
     finally:
-        if not inter.is_terminated:
-           inter.startFinalization()
-        await inter.termination_task
-        try:
-            # avoid recursion in termination calls!
-            win.unbind('<Destroy>')
-            win.destroy()
-        except Exception:
-            pass
+        win.dispatcher.is_closed = True
+        aio.run_coroutine_threadsafe(finalize(inter, services), inter.loop).result()
+        inter.loop.call_soon_threadsafe(inter.loop.stop)
+        loop_thread.join()
+
+def run_headless(inter, services):
+    # no UI: the event loop runs in this thread, until MASSS is interrupted (ctrl-C, SIGTERM)
+    loop = inter.loop
+    inter.add_task(inter.clean__refill())  # create the base instances
+    interrupted = loop.create_future()
+
+    def on_signal():
+        if interrupted.done():
+            print('MASSS is quitting, please wait')
+        else:
+            interrupted.set_result(None)
+
+    if sys.platform != 'win32':
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, on_signal)
+    try:
+        loop.run_until_complete(interrupted)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print('quitting')
+        loop.run_until_complete(finalize(inter, services))
 
 def main():
-    inter = VlcInterface()
+    parser = argparse.ArgumentParser(description='MASSS - Multiplatform ASSS')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='rc',
+                        help='playback backend: one vlc process per instance (rc, default) '
+                             'or media players inside the MASSS process (libvlc). '
+                             'the fake backend plays nothing, for tests')
+    parser.add_argument('--no-prebuild', action='store_true',
+                        help='only build the tabs when they are selected, not in the background')
+    parser.add_argument('--no-watch', action='store_true',
+                        help="don't update the tabs when files are added to (or removed from) the sounds directory")
+    parser.add_argument('--mixer', metavar='SINK', default=None,
+                        help='play the short sounds with the built-in mixer instead of vlc (needs numpy). '
+                             "SINK is 'audio' (the sound card, needs sounddevice), 'null' (nowhere), or a wav file to write")
+    parser.add_argument('--mixer-max-size', type=float, default=4,
+                        help='files bigger than this (in MB) are played by vlc (default: 4)')
+    parser.add_argument('--mixer-max-length', type=float, default=10,
+                        help='files longer than this (in seconds) are played by vlc (default: 10)')
+    parser.add_argument('--fake-options', default='',
+                        help='options for fakevlc.py, with the fake backend (see `fakevlc.py --help`)')
+    parser.add_argument('--min-idle', type=int, default=2,
+                        help='number of idle VLC instances kept ready (default: 2)')
+    parser.add_argument('--max-idle', type=int, default=4,
+                        help='idle VLC instances above this number are terminated (default: 4)')
+    parser.add_argument('--max-total', type=int, default=32,
+                        help='maximum number of VLC instances (default: 32)')
+    parser.add_argument('--max-spawning', type=int, default=8,
+                        help='maximum number of VLC instances started at once in the background (default: 8)')
+    parser.add_argument('--max-hot', type=int, default=8,
+                        help='maximum number of hot sounds, each kept ready in its own VLC instance (default: 8)')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='serve the health measures of the pool and of the playback on this port of localhost '
+                             '(prometheus format at /metrics, json at /metrics.json)')
+    parser.add_argument('--metrics-json', metavar='FILE', default=None,
+                        help='also save the measures to this json file every --metrics-interval seconds')
+    parser.add_argument('--metrics-interval', type=float, default=10,
+                        help='seconds between two saves of --metrics-json (default: 10)')
+    parser.add_argument('--trace', metavar='FILE', default=None,
+                        help='record what happens for each press, and save it to this file when quitting '
+                             '(chrome trace-event format: open it in https://ui.perfetto.dev or chrome://tracing)')
+    parser.add_argument('--control', metavar='ADDRESS', default=None,
+                        help='let other programs play sounds through a local socket (see control.py for the protocol). '
+                             "ADDRESS is 'unix:/path/to/socket', or 'tcp:PORT' (on localhost) or 'tcp:HOST:PORT'")
+    parser.add_argument('--headless', action='store_true',
+                        help='run without any window: the sounds are only played through --control')
+    args = parser.parse_args()
+    if args.headless and args.control is None:
+        parser.error('--headless needs --control (there would be no way to play anything)')
+    if args.backend == 'libvlc':
+        get_libvlc()  # fail now if the bindings are missing, rather than at the first instance
+    FakeVlcInstance.fake_options = shlex.split(args.fake_options)
+    if args.trace is not None:
+        TRACER.start(args.trace)
+
+    inter = VlcInterface(args.min_idle, args.max_idle, args.max_total,
+                         BACKENDS[args.backend], args.max_spawning, max_hot=args.max_hot)
+    if args.mixer is not None:
+        mixer.check_numpy()
+        inter.mixer = mixer.Mixer(mixer.make_sink(args.mixer), inter.loop,
+                                  int(args.mixer_max_size * 2**20), args.mixer_max_length)
     inter.vol(0.5)
     #inter.cleaningtask = win.after(500, inter.clean)  # schedule cleaning every half second
 
-    win = UI.create_ui(inter)
+    # read the sounds directory (only what changed since the last launch)
+    library = LibraryIndex('./sounds', './sounds_index.json')
+    library.load()
+    library.scan()
+    library.save()
+
+    # the track lengths, read in the background
+    inter.metadata = MetadataCache('./sounds_metadata.json', inter.loop)
+    inter.metadata.load()
+    inter.metadata.prefetch(library.files())
+
+    controller = Controller(inter, library)
+    win = None if args.headless else UI.create_ui(controller, library, not args.no_prebuild)
+    services = []
+    if args.control is not None:
+        control_server = ControlServer(controller, args.control)
+        inter.add_task(control_server.start())
+        services.append(control_server)
+    if args.metrics_port is not None:
+        server = MetricsServer(inter.loop, args.metrics_port)
+        inter.add_task(server.start())
+        services.append(server)
+    if args.metrics_json is not None:
+        dumper = JsonDumper(inter.loop, args.metrics_json, args.metrics_interval)
+        dumper.start()
+        services.append(dumper)
+    if not args.no_watch:
+        def on_library_change(changed):
+            if win is not None:
+                win.dispatcher.call(win.file_chooser.onLibraryChange, changed)
+            inter.metadata.prefetch(library.files(changed))
+            controller.library_changed(changed)
+        watcher = SoundsWatcher(library, inter.loop, on_library_change)
+        watcher.start()
+        services.append(watcher)
     #inter.loop.set_exception_handler(exc_handl)
-    inter.loop.run_until_complete(mainloop(win, inter))
+    if args.headless:
+        run_headless(inter, services)
+    else:
+        mainloop(win, inter, services)
+    TRACER.save()
 
 if __name__ == "__main__":
     main()
@@ -8,159 +8,437 @@ import os.path
 import re
 import tkinter as tk
 import tkinter.ttk as ttk
+import tkinter.font as tkfont
 import asyncio as aio
+import queue
 from math import floor, ceil
+from tracer import TRACER
+
+
+# Tk runs in the main thread, the event loop (and so, VlcInterface) in another one.
+# the UI is a client of the control.Controller (`interface` here), like the clients of the control socket:
+# it sends its commands with interface.call(), and the callbacks come back to the UI through the Dispatcher.
+# nothing polls (except on windows), both threads sleep when nothing happens.
+class Dispatcher:
+    """runs functions in Tk's thread, on behalf of the other threads"""
+    POLL_DELAY = 20  # ms, only where Tk can't watch a pipe (windows)
+
+    def __init__(self, win):
+        self.win = win
+        self.queue = queue.Queue()
+        self.is_closed = False  # set once Tk's mainloop is over: nothing can be run anymore
+        # Tk is woken up by a byte written to a pipe. (calling Tk itself from another thread would wait
+        # for Tk's thread to be free: a slow UI callback would stall the caller)
+        self.wakeup = None  # the write end of the pipe
+        if hasattr(win.tk, 'createfilehandler') and sys.platform != 'win32':
+            read_fd, self.wakeup = os.pipe()
+            os.set_blocking(read_fd, False)
+            os.set_blocking(self.wakeup, False)
+            win.tk.createfilehandler(read_fd, tk.READABLE, self.onWakeup)
+        else:
+            win.after(self.POLL_DELAY, self.poll)
 
-skip_detector = re.compile(r'(?P<core>.*?)\#'+
-                           r'(?P<seconds>[0-9]*)'+
-                           r'\.(?P<ext>[a-zA-Z0-9]*)')
-
-# This class create a gtk.ToggleButton linked to a sound file.
-# Send "toggle", it plays the sound. Send "toggle" again, it stops.
-class SndButton(tk.Frame):   # ## a button associated to a file. sends playback commands
-    def __init__(self, master, fullname, interface, parent_scrollableframe):
-        tk.Frame.__init__(self, master)
-
+    def call(self, function, *args):
+        """calls function(*args) in Tk's thread, as soon as possible. can be called from any thread, never blocks"""
+        if self.is_closed:
+            return
+        self.queue.put((function, args))
+        if self.wakeup is not None:
+            try:
+                os.write(self.wakeup, b'.')
+            except BlockingIOError:
+                pass  # the pipe is full: Tk is going to wake up anyway
+
+    def onWakeup(self, fd, mask):
+        try:
+            os.read(fd, 4096)
+        except BlockingIOError:
+            pass
+        self.onDispatch()
+
+    def onDispatch(self, event=None):
+        while True:
+            try:
+                function, args = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            function(*args)
+
+    def poll(self):
+        self.onDispatch()
+        self.win.after(self.POLL_DELAY, self.poll)
+
+
+# a sound file, and its button's state. sends playback commands.
+# press it, it plays the sound. press it again, it stops.
+# it is not a widget: FileChooserFrame draws it (only when it is visible).
+class SndButton:   # ## a button associated to a file. sends playback commands
+    def __init__(self, fullname, skip, interface, view):
         self.filename = fullname
         self.name = os.path.split(fullname)[1]
         self.interface = interface
+        self.view = view  # the FileChooserFrame which draws this button
+        self.row = None  # its row in the view
         self.vol_modifier = 1.0
         self.instance_id = None
-        has_skip = skip_detector.fullmatch(self.name)
-
-        if has_skip:
-            self.skip = has_skip.groupdict()['seconds'] [:-1]
-            # the [:-1] is because tenths of seconds cannot be skipped yet.
-        else:
-            self.skip = None
-
-        self.state = tk.IntVar(master)
-        self.btn = tk.Checkbutton(self, text=self.name,
-                                           command=self.onPress, indicatoron=0, variable=self.state, compound=tk.BOTTOM)
-
-        self.vol = tk.Scale(self, from_=0, to=2, orient=tk.HORIZONTAL, resolution=0.05, length=150, command=self.onUpdate)
-        self.vol.set(1)
-        self.vol.pack(side=tk.LEFT)
-
-        self.btn.pack(side=tk.LEFT, fill=tk.X)
-
-        # ensure correct scrolling for parent...
-        for binded in (self, self.btn, self.vol):
-            binded.bind("<MouseWheel>", parent_scrollableframe.onMousewheel)
-            binded.bind("<Button-4>", parent_scrollableframe.onMousewheel)
-            binded.bind("<Button-5>", parent_scrollableframe.onMousewheel)
-
-
+        self.skip = skip  # seconds to skip (from the filename, see library.parse_skip)
+        self.state = 0  # 1 when playing
+        self.press_id = None  # id of the last press, in the trace (see tracer.py)
+        self.is_hot = False  # kept ready to play (see VlcInterface.set_hot). changed by MainFileChooser.onHotChange
 
     def onPress(self, event=None):
-        if self.state.get()==1:  # at this point, the state is already changed!
-            # this will have to be done in two parts:
-            # the polling and the callback (because play() is a coroutine)
-            # callback is another method
-            playtask = self.interface.loop.create_task(
-                self.interface.play(self.filename, self.skip, self.onStop)
-            )
-            playtask.add_done_callback(self._onPress_activate_part2)
-        else:
-            if self.instance_id is None:
-                # it didn't start playing completely
-                print("warning: tried to stop track before full activation")
-            inst_id = self.instance_id
-            self.instance_id = None
-            self.interface.stop(inst_id)
+        self.state = 1 - self.state
+        if self.state==1:
+            self.press_id = TRACER.new_press()
+        with TRACER.span('ui press' if self.state==1 else 'ui stop', self.press_id, file=self.name):
+            self.view.redrawButton(self)
+            if self.state==1:
+                # this will have to be done in two parts:
+                # the polling and the callback (because play() is a coroutine)
+                # callback is another method
+                dispatcher = self.view.winfo_toplevel().dispatcher
+                playtask = aio.run_coroutine_threadsafe(
+                    self.interface.play(self.filename, self.skip, lambda: dispatcher.call(self.onStop), self.press_id),
+                    self.interface.loop
+                )
+                playtask.add_done_callback(lambda future: dispatcher.call(self._onPress_activate_part2, future))
+            else:
+                if self.instance_id is None:
+                    # it didn't start playing completely
+                    print("warning: tried to stop track before full activation")
+                inst_id = self.instance_id
+                self.instance_id = None
+                self.interface.call(self.interface.stop, inst_id)
 
     def _onPress_activate_part2(self, future):
         """the callback for when the VLC instance started playing"""
-        result = future.result()
-        self.instance_id = result
-        self.onUpdate()
+        with TRACER.span('ui activate', self.press_id):
+            result = future.result()
+            if result is None:  # no instance available: the track was not played
+                self.onStop()
+                return
+            self.instance_id = result
+            self.onUpdate()
 
 
     def onUpdate(self, event=None):
         if self.instance_id is not None:
-            self.interface.set_vol_mod(self.instance_id, self.vol.get())
+            self.interface.call(self.interface.set_vol_mod, self.instance_id, self.vol_modifier)
 
     def onStop(self):
-        self.state.set(0)
-        self.btn.deselect()
+        self.state = 0
+        self.view.redrawButton(self)
+
+    def setHot(self, is_hot):
+        """asks for the sound to be hot (or not). the button is redrawn when the answer comes"""
+        self.interface.call(self.interface.set_hot, self.filename, is_hot)
 
 class MainFileChooser(ttk.Notebook):  # the main panel to load audio files
-    def __init__(self, master, interface, directory):
+    def __init__(self, master, interface, library, prebuild=True):
         ttk.Notebook.__init__(self, master)
+        # the tabs' contents are only built when a tab is selected for the first time,
+        # and (if prebuild) when Tk has nothing better to do, starting with the neighbours of the selected tab.
+        self.prebuild = prebuild
 
-        dirs = os.listdir(directory)
+        self.interface = interface
+        self.library = library
+        self.frames = {}  # directory -> tab ('' for the files of the root directory)
+        self.updateTabs()
+
+        self.bind('<<NotebookTabChanged>>', self.onTabChanged)
+        self.after_idle(self.onTabChanged)  # the first tab, once the window is there
 
-        subfiles=[]
-        for subdir in dirs:
-            fullname = os.path.join(directory, subdir)
-            if os.path.isdir(fullname):
-                frame = FileChooserFrame(self, interface, fullname)
-                self.add(frame, text=subdir)
+    def onTabChanged(self, event=None):
+        if not self.tabs():
+            return
+        self.nametowidget(self.select()).build()
+        if self.prebuild:
+            self.after_idle(self.prebuildTabs)
+
+    def prebuildTabs(self):
+        """builds one tab, then schedules itself again for the next idle time"""
+        tabs = self.tabs()
+        current = self.index('current')
+        # closest tabs first
+        for i in sorted(range(len(tabs)), key=lambda i: abs(i-current)):
+            frame = self.nametowidget(tabs[i])
+            if not frame.is_built:
+                frame.build()
+                self.after_idle(self.prebuildTabs)
+                return
+
+    def updateTabs(self):
+        """creates the tabs of the new directories, removes the ones of the removed directories"""
+        root = self.library.listing('')
+        wanted = list(root['dirs'])
+        if root['files']:
+            wanted.append('')
+        for directory in list(self.frames):
+            if directory not in wanted:
+                self.frames.pop(directory).destroy()  # the sounds it is playing go on
+        for i, directory in enumerate(wanted):
+            if directory not in self.frames:
+                self.frames[directory] = FileChooserFrame(self, self.interface, self.library, directory,
+                                                          is_root=(directory==''))
+            self.insert(i if i < len(self.tabs()) else 'end', self.frames[directory],
+                        text=directory or 'SOUNDS_ROOT')
+
+    def onHotChange(self, path, is_hot):
+        """a sound became hot, or stopped being hot"""
+        for frame in self.frames.values():
+            for item in frame.rows:
+                if isinstance(item, SndButton) and item.filename == path:
+                    item.is_hot = is_hot
+                    frame.redrawButton(item)
+
+    def onLibraryChange(self, changed):
+        """updates the tabs showing the directories (relative to the library root) which changed"""
+        if '' in changed:
+            self.updateTabs()
+        for directory, frame in self.frames.items():
+            if directory == '':
+                affected = '' in changed
             else:
-                subfiles.append(fullname)
-        if subfiles:
-            frame = FileChooserFrame(self, interface, directory, is_root=True)
-            self.add(frame, text='SOUNDS_ROOT')
+                affected = any(d == directory or os.path.dirname(d) == directory for d in changed)
+            if affected:
+                frame.reload()
+        if self.tabs():
+            self.onTabChanged()  # builds the new tabs
 
 
 class FileChooserFrame(tk.Frame):  # one of the 'tabs' of the file panel
-    def __init__(self, master, interface, directory, is_root=False):
-        # ## basic UI configuration (heavier because we need a scrollable frame)
+    # the buttons are drawn on a canvas, one row each, and only the visible rows are drawn:
+    # scrolling and redrawing don't depend on the number of files in the tab.
+    # the volume of a file is shown on the left of its button. click it to get a volume slider.
+    # shift-click a button to make its sound hot (or not), or a section title for all the sounds of the section.
+    ROW_HEIGHT = 26
+    VOL_WIDTH = 48  # width of the volume part of a row
+    COLORS = {'idle': '#d9d9d9', 'playing': '#8fbc8f', 'outline': '#a0a0a0', 'section': '#505050', 'hot': '#d2691e'}
+
+    def __init__(self, master, interface, library, directory, is_root=False):
+        # `directory` is relative to the library root
         tk.Frame.__init__(self, master)
 
-        self.inner = tk.Canvas(self)
-
-        self.inframe = tk.Frame(self.inner)
-
+        self.inner = tk.Canvas(self, highlightthickness=0, yscrollincrement=self.ROW_HEIGHT)
         self.bar = tk.Scrollbar(self, command=self.inner.yview)
         self.bar.pack(side = tk.RIGHT, fill = tk.Y)
-        self.inner.configure(yscrollcommand = self.bar.set)
-        self.inframe_id = self.inner.create_window((0,0), window=self.inframe, anchor="nw")
-        self.inframe.bind('<Configure>', self.onInnerConfigure)
+        self.inner.configure(yscrollcommand = self.onScroll)
         self.inner.pack(fill=tk.BOTH, expand=1)
 
+        self.inner.bind('<Configure>', self.onInnerConfigure)
+        self.inner.bind('<Button-1>', self.onClick)
+        self.inner.bind('<Button-3>', self.onRightClick)
+        self.inner.bind('<Shift-Button-1>', self.onShiftClick)
         self.inner.bind("<MouseWheel>", self.onMousewheel)
         self.inner.bind("<Button-4>", self.onMousewheel)
         self.inner.bind("<Button-5>", self.onMousewheel)
 
+        self.font = tkfont.nametofont('TkDefaultFont')
+        self.bold = self.font.copy()
+        self.bold.configure(weight='bold')
+
+        self.rows = []  # a section name (str) or a SndButton for each row
+        self.drawn = {}  # row -> canvas items of the visible rows
+        self.slider = None  # the volume slider (a real widget), and the button it controls
+        self.slider_button = None
+        self.slider_item = None
+
+        # the rows are created by build(), called by MainFileChooser
+        self.interface = interface
+        self.library = library
+        self.directory = directory
+        self.is_root = is_root
+        self.is_built = False
+
+    def build(self):
+        """creates the buttons of the tab (only once)"""
+        if self.is_built:
+            return
+        self.is_built = True
+        self.makeRows()
+
+    def reload(self):
+        """reads the tab's directories again. the buttons of the files which are still there are kept
+        (with their volume, and the sound they are playing)"""
+        if not self.is_built:
+            return  # it will be built from the new listing anyway
+        old = {item.filename: item for item in self.rows if isinstance(item, SndButton)}
+        self.makeRows(old)
+        for button in old.values():  # removed files: they go on playing, but aren't drawn anymore
+            button.row = None
+
+    def makeRows(self, old=None):
+        """creates the rows of the tab from the library, reusing the buttons of `old` (filename -> button).
+        the reused buttons are removed from `old`"""
+        interface, library, directory = self.interface, self.library, self.directory
+        old = {} if old is None else old
+        self.rows = []
+
+        def add_files(reldir, files):
+            for file in files:
+                filename = library.path(reldir, file['name'])
+                button = old.pop(filename, None)
+                if button is None:
+                    button = SndButton(filename, file['skip'], interface, self)
+                self.rows.append(button)
+
         # subdir (and subfile) configuration
-        subdirs = os.listdir(directory)
-        subfiles = []
-        i=0
-        for i, subdir in enumerate(subdirs):
-            is_dir = os.path.isdir(os.path.join(directory, subdir))
-            if is_dir and not is_root:
-                frame = tk.LabelFrame(self.inframe, text=subdir, labelanchor='n')
-                #frame.columnconfigure(0, weight=1)
-
-                # manually bind children too to ensure correct scrolling...
-                frame.bind("<MouseWheel>", self.onMousewheel)
-                frame.bind("<Button-4>", self.onMousewheel)
-                frame.bind("<Button-5>", self.onMousewheel)
-
-                files = os.listdir(os.path.join(directory, subdir))
-
-                for j, file in enumerate(files):
-                    button = SndButton(frame, os.path.join(directory, subdir, file), interface, self)
-                    button.pack(fill=tk.X)
-                frame.grid(column=0,row=i, sticky='W')
-            elif not is_dir:  # check that only files end up here
-                subfiles.append(subdir)
-
-        if subfiles:
-            frame = tk.LabelFrame(self.inframe, text='DIR_ROOT', labelanchor='n')
-            for j, file in enumerate(subfiles):
-                button = SndButton(frame, os.path.join(directory, file), interface)
-                button.pack(fill=tk.X)
-            frame.grid(column=0,row=i+1, align='W')
+        dirs = library.dirs  # one version of the index: the watcher may replace it meanwhile (see LibraryIndex.scan)
+        listing = dirs.get(directory, {'dirs': [], 'files': []})  # (removed: its tab is about to go)
+        if not self.is_root:
+            for subdir in listing['dirs']:
+                reldir = os.path.join(directory, subdir)
+                if reldir in dirs:
+                    self.rows.append(subdir)
+                    add_files(reldir, dirs[reldir]['files'])
+
+        if listing['files']:
+            self.rows.append('DIR_ROOT')
+            add_files(directory, listing['files'])
+
+        self.layout()
+
+    def layout(self):
+        """sizes the canvas for the current rows, and redraws them"""
+        for row, item in enumerate(self.rows):
+            if isinstance(item, SndButton):
+                item.row = row
+        # the width of the longest names (only measuring the longest strings is enough)
+        names = sorted((item if isinstance(item, str) else item.name for item in self.rows),
+                       key=len, reverse=True)[:20]
+        width = max([self.font.measure(name) for name in names] + [100])
+        self.inner.configure(width=width + self.VOL_WIDTH + 16,
+                             scrollregion=(0, 0, 0, len(self.rows)*self.ROW_HEIGHT))
+        self.hideSlider()
+        self.redraw(full=True)
+
+    # ## drawing
+    def visibleRows(self):
+        top = self.inner.canvasy(0)
+        bottom = top + self.inner.winfo_height()
+        first = max(0, int(top // self.ROW_HEIGHT))
+        last = min(len(self.rows), int(bottom // self.ROW_HEIGHT) + 1)
+        return range(first, last)
+
+    def redraw(self, full=False):
+        """draws the visible rows, and deletes the others"""
+        visible = self.visibleRows()
+        for row in list(self.drawn):
+            if full or row not in visible:
+                self.inner.delete(*self.drawn.pop(row))
+        for row in visible:
+            if row not in self.drawn:
+                self.drawn[row] = self.drawRow(row)
+        if self.slider_button is not None and self.slider_button.row not in visible:
+            self.hideSlider()
+
+    def drawRow(self, row):
+        item = self.rows[row]
+        y = row * self.ROW_HEIGHT
+        width = self.inner.winfo_width()
+        if isinstance(item, str):  # section title
+            return [self.inner.create_line(4, y+self.ROW_HEIGHT-3, width-4, y+self.ROW_HEIGHT-3,
+                                           fill=self.COLORS['section']),
+                    self.inner.create_text(width//2, y+self.ROW_HEIGHT//2, text=item,
+                                           font=self.bold, fill=self.COLORS['section'])]
+        fill = self.COLORS['playing' if item.state else 'idle']
+        return [self.inner.create_text(self.VOL_WIDTH//2, y+self.ROW_HEIGHT//2,
+                                       text='{:.2f}'.format(item.vol_modifier), font=self.font),
+                self.inner.create_rectangle(self.VOL_WIDTH, y+1, width-2, y+self.ROW_HEIGHT-1,
+                                            fill=fill, **self.outline(item)),
+                self.inner.create_text(self.VOL_WIDTH+6, y+self.ROW_HEIGHT//2, text=item.name,
+                                       anchor='w', font=self.font)]
+
+    def redrawButton(self, button):
+        """updates the row of a button, if it is visible"""
+        items = self.drawn.get(button.row)
+        if items is not None and self.winfo_exists():
+            self.inner.itemconfigure(items[0], text='{:.2f}'.format(button.vol_modifier))
+            self.inner.itemconfigure(items[1], fill=self.COLORS['playing' if button.state else 'idle'],
+                                     **self.outline(button))
+
+    def outline(self, button):
+        """the outline options of a button's rectangle: thick for the hot sounds"""
+        if button.is_hot:
+            return {'outline': self.COLORS['hot'], 'width': 3}
+        return {'outline': self.COLORS['outline'], 'width': 1}
+
+    # ## volume slider, created on demand
+    def showSlider(self, button):
+        if self.slider is None:
+            self.slider = tk.Scale(self.inner, from_=0, to=2, orient=tk.HORIZONTAL, resolution=0.05,
+                                   length=150, showvalue=0, command=self.onSlider)
+        self.hideSlider()
+        self.slider_button = button
+        self.slider.set(button.vol_modifier)
+        self.slider_item = self.inner.create_window(self.VOL_WIDTH, button.row*self.ROW_HEIGHT,
+                                                    window=self.slider, anchor='nw',
+                                                    height=self.ROW_HEIGHT)
+
+    def hideSlider(self):
+        if self.slider_item is not None:
+            self.inner.delete(self.slider_item)
+        self.slider_item = None
+        self.slider_button = None
+
+    def onSlider(self, value):
+        button = self.slider_button
+        if button is not None:
+            button.vol_modifier = float(value)
+            self.redrawButton(button)
+            button.onUpdate()
+
+    # ## events
+    def onScroll(self, first, last):
+        self.bar.set(first, last)
+        self.redraw()
 
     def onInnerConfigure(self, event):
-        '''Reset the scroll region to encompass the inner frame'''
-        self.inner.configure(scrollregion=self.inner.bbox("all"))
-        # change canvas width. somehow only height is done automatically
-        self.inframe.update_idletasks()
-        self.inner.configure(width=self.inframe.winfo_width())
-        self.configure(width=self.inner.winfo_width()+self.bar.winfo_width())
+        '''redraw the rows for the new canvas size'''
+        self.redraw(full=True)
+
+    def buttonAt(self, event):
+        row = int(self.inner.canvasy(event.y) // self.ROW_HEIGHT)
+        if 0 <= row < len(self.rows) and isinstance(self.rows[row], SndButton):
+            return self.rows[row]
+        return None
+
+    def onClick(self, event):
+        button = self.buttonAt(event)
+        if button is None or button is self.slider_button:
+            self.hideSlider()
+        elif event.x < self.VOL_WIDTH:
+            self.showSlider(button)
+        else:
+            self.hideSlider()
+            button.onPress()
+
+    def onRightClick(self, event):
+        button = self.buttonAt(event)
+        if button is None:
+            self.hideSlider()
+        else:
+            self.showSlider(button)
+
+    def onShiftClick(self, event):
+        """makes a sound hot (or not). on a section title: all the sounds of the section
+        (they all become hot, unless they all are already)"""
+        self.hideSlider()
+        row = int(self.inner.canvasy(event.y) // self.ROW_HEIGHT)
+        if not 0 <= row < len(self.rows):
+            return
+        if isinstance(self.rows[row], SndButton):
+            buttons = [self.rows[row]]
+        else:
+            buttons = []
+            for item in self.rows[row+1:]:
+                if isinstance(item, str):
+                    break
+                buttons.append(item)
+        is_hot = not all(button.is_hot for button in buttons)
+        for button in buttons:
+            if button.is_hot != is_hot:
+                button.setHot(is_hot)
 
     def onMousewheel(self, event):
         if event.delta != 0:
@@ -177,7 +455,7 @@ class FileChooserFrame(tk.Frame):  # one of the 'tabs' of the file panel
         return "break"
 
 class EqFrame(tk.LabelFrame):
-    """frame with the equaliser bars. knows when to call the VlcInterface to adjust its equalizer."""
+    """frame with the equaliser bars. knows when to ask the controller to adjust its equalizer."""
     def __init__(self, master, interface):
         tk.LabelFrame.__init__(self, master, text='Equalizer (values in dB)', labelanchor = 'n')
 
@@ -207,7 +485,7 @@ class EqFrame(tk.LabelFrame):
         self.sendUpdate()
     def sendUpdate(self, event=None):
         print("EqFrame-sendUpdate")
-        self.interface.eq(self.getstr())
+        self.interface.call(self.interface.eq, self.getstr())
 
 class VolFrame(tk.LabelFrame):   # ## a widget to control volume
     def __init__(self, master, interface):
@@ -225,7 +503,7 @@ class VolFrame(tk.LabelFrame):   # ## a widget to control volume
         self.bar.grid(row=1, column = 0, sticky='news')
 
     def onUpdate(self, event=None):
-        self.interface.vol(self.bar.get()/100)
+        self.interface.call(self.interface.vol, self.bar.get()/100)
 
 class OverrideFrame(tk.LabelFrame):  # for the volume override
     def __init__(self, master, interface):
@@ -243,37 +521,51 @@ class OverrideFrame(tk.LabelFrame):  # for the volume override
 
     def onPress(self, event=None):
         if self.enable.get():
-            if re.fullmatch('[0-9]+', self.entry.get()):
-                self.interface.skip_override = self.entry.get()
+            if re.fullmatch(r'[0-9]+(\.[0-9]*)?', self.entry.get()):
+                self.interface.call(self.interface.set_skip_override, float(self.entry.get()))
             else:
-                print('skip override must be an int')
+                print('skip override must be a number of seconds')
 
         else:
-            self.interface.skip_override = None
+            self.interface.call(self.interface.set_skip_override, None)
 
 
-def create_ui(vlc_interface):
+def create_ui(controller, library, prebuild=True):
     win = tk.Tk()
+    win.dispatcher = Dispatcher(win)
     win.rowconfigure(0, weight=1)  # UI stratching configuration...
     win.columnconfigure(0, minsize=100, weight=0)
     win.columnconfigure(1, weight=100)
     win.columnconfigure(2, weight=1)
 
-    a = MainFileChooser(win, vlc_interface, './sounds')
+    a = MainFileChooser(win, controller, library, prebuild)
     a.grid(row=0, column=0, sticky='wnes', rowspan=2)
+    win.file_chooser = a  # for the updates of the sounds directory
+
+    def on_event(event):  # (in the event loop's thread)
+        if event['event'] == 'hot':
+            relpath = event['path'].replace('/', os.sep)
+            path = library.path(os.path.dirname(relpath), os.path.basename(relpath))
+            win.dispatcher.call(a.onHotChange, path, event['on'])
+    controller.subscribe(on_event)
 
-    b = EqFrame(win, vlc_interface)
+    b = EqFrame(win, controller)
     b.grid(row=0, column=1, sticky='news', rowspan=2)
 
-    v = VolFrame(win, vlc_interface)
+    v = VolFrame(win, controller)
     v.grid(row=0, column=2, sticky='nes')
 
-    s = OverrideFrame(win, vlc_interface)
+    s = OverrideFrame(win, controller)
     s.grid(row=1, column=2, sticky='es')
     if sys.platform!='linux':
         # this is windows. add the 'foreground' option
         win.wm_attributes("-topmost", 1)
 
-    win.bind('<Destroy>', vlc_interface.startFinalization)
+    def on_destroy(event):
+        # every widget of the window inherits this binding: only quit when the window itself goes away
+        # (not when the tab of a removed directory does)
+        if event.widget is win:
+            controller.call(controller.quit)
+    win.bind('<Destroy>', on_destroy)
 
     return win
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# click-to-play latency benchmark.
+# drives VlcInterface.play/stop directly (just like SndButton.onPress does), and measures the time
+# between the call to play() and the moment the `add` command reaches vlc.
+# runs against the real vlc, or against fakevlc.py (the default: no audio needed):
+#     python3 bench.py --backend fake --fake-options "--fake-startup-delay 0.3 --fake-latency 0.005"
+#     python3 bench.py --backend rc --file ./sounds/some/file.mp3
+
+import sys
+import os
+import argparse
+import shlex
+import tempfile
+import wave
+import math
+import asyncio as aio
+from time import monotonic as time
+
+from MASSS import VlcInterface, BACKENDS
+from instances import FakeVlcInstance
+
+SCENARIOS = ['cold', 'warmup', 'warm', 'burst10', 'burst50', 'burst100', 'eq']
+
+
+# ## helper functions
+def percentile(values, p):
+    """nearest-rank percentile of a list of values (p between 0 and 100)"""
+    values = sorted(values)
+    if not values:
+        return float('nan')
+    rank = max(0, min(len(values)-1, math.ceil(p/100 * len(values)) - 1))
+    return values[rank]
+
+def make_silence(duration=2.0):
+    """creates a silent wav file, and returns its path"""
+    fd, path = tempfile.mkstemp(suffix='.wav', prefix='masss-bench-')
+    os.close(fd)
+    with wave.open(path, 'wb') as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(8000)
+        file.writeframes(b'\0\0' * int(8000*duration))
+    return path
+
+def recording_class(base, created):
+    """subclass of the backend `base` which keeps a reference to every instance in `created`"""
+    class Recorded(base):
+        def __init__(self, *args):
+            base.__init__(self, *args)
+            created.append(self)
+    return Recorded
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.loop = aio.get_event_loop()
+        self.latencies = {}  # scenario -> list of press-to-add latencies
+        self.spawns = {}  # scenario -> list of instance spawn durations
+
+    def new_interface(self, max_total=None, eq_debounce=0.3):
+        created = []
+        inter = VlcInterface(self.args.min_idle, self.args.max_idle,
+                             max(max_total or 0, self.args.max_total),
+                             recording_class(BACKENDS[self.args.backend], created),
+                             self.args.max_spawning, eq_debounce)
+        inter.created = created
+        return inter
+
+    async def close_interface(self, inter, name):
+        self.spawns[name] = [inst.spawn_duration for inst in inter.created
+                             if inst.spawn_duration is not None]
+        inter.startFinalization()
+        await inter.termination_task
+
+    async def wait_warm(self, inter, n, timeout=30):
+        """waits until `n` instances are idle"""
+        end = time() + timeout
+        while inter.count_idle() < n:
+            if time() > end:
+                raise RuntimeError('the pool did not warm up in {:d} seconds'.format(timeout))
+            await inter.clean__refill()
+            await aio.sleep(0.02)
+
+    async def press(self, inter):
+        """one press: returns the voice handle and the press-to-add latency"""
+        beg = time()
+        i = await inter.play(self.args.file, None)
+        if i is None:
+            return None, None
+        # (not pool.get: on a loaded machine, the track may be over already)
+        inst = inter.pool.slots[i.slot]
+        if inst is None or inst.add_time is None:  # its instance broke meanwhile: no measure
+            return i, None
+        return i, inst.add_time - beg
+
+    async def release(self, inter, ids):
+        for i in ids:
+            if inter.pool.get(i) is not None:  # still playing
+                inter.stop(i)
+
+    # ## scenarios
+    async def run_cold(self):
+        """first press on an empty pool: includes the spawn of the instance"""
+        latencies = []
+        spawns = []
+        for _ in range(self.args.repeat_cold):
+            inter = self.new_interface()
+            inter.min_idle = 0  # don't let the background refill hide the spawn
+            i, latency = await self.press(inter)
+            latencies.append(latency)
+            await self.release(inter, [i])
+            await self.close_interface(inter, 'cold')
+            spawns += self.spawns['cold']
+        self.spawns['cold'] = spawns
+        return latencies
+
+    async def run_warmup(self):
+        """time for an empty pool to get min_idle idle instances (reported as press latencies)"""
+        durations = []
+        spawns = []
+        for _ in range(self.args.repeat_cold):
+            inter = self.new_interface()
+            beg = time()
+            await self.wait_warm(inter, max(1, inter.min_idle))
+            durations.append(time() - beg)
+            await self.close_interface(inter, 'warmup')
+            spawns += self.spawns['warmup']
+        self.spawns['warmup'] = spawns
+        return durations
+
+    async def run_warm(self):
+        """isolated presses on a warm pool"""
+        inter = self.new_interface()
+        latencies = []
+        for _ in range(self.args.repeat):
+            await self.wait_warm(inter, max(1, inter.min_idle))
+            i, latency = await self.press(inter)
+            latencies.append(latency)
+            await aio.sleep(0.01)
+            await self.release(inter, [i])
+        await self.close_interface(inter, 'warm')
+        return latencies
+
+    async def run_burst(self, n):
+        """n simultaneous presses on a warm pool"""
+        inter = self.new_interface(max_total=n + self.args.max_idle)
+        await self.wait_warm(inter, max(1, inter.min_idle))
+        results = await aio.gather(*[self.press(inter) for _ in range(n)])
+        await self.release(inter, [i for i, _ in results])
+        await self.close_interface(inter, 'burst{:d}'.format(n))
+        return [latency for _, latency in results if latency is not None]
+
+    async def run_eq(self):
+        """presses while the pool respawns after an equalizer change"""
+        inter = self.new_interface(eq_debounce=0)  # the rebuild starts right away
+        latencies = []
+        for k in range(self.args.repeat):
+            await self.wait_warm(inter, max(1, inter.min_idle))
+            inter.eq(' ' + 10*'{:d} '.format(k % 5))
+            while inter.rebuild_token is not None:  # (None right away if the backend applies it live)
+                await aio.sleep(0)
+            i, latency = await self.press(inter)
+            latencies.append(latency)
+            await aio.sleep(0.01)
+            await self.release(inter, [i])
+            if inter.rebuild_task is not None:
+                await inter.rebuild_task  # each change gets a whole respawn
+        await self.close_interface(inter, 'eq')
+        return latencies
+
+    async def run(self):
+        for name in self.args.scenarios:
+            print('### running scenario', name, file=sys.stderr)
+            if name.startswith('burst'):
+                latencies = await self.run_burst(int(name[5:]))
+            else:
+                latencies = await getattr(self, 'run_'+name)()
+            self.latencies[name] = [l for l in latencies if l is not None]
+
+    def report(self):
+        lines = ['backend: {:s}   file: {:s}   pool: min_idle={:d} max_idle={:d}'.format(
+                    self.args.backend, self.args.file, self.args.min_idle, self.args.max_idle),
+                 '{:<10s}{:>7s}{:>10s}{:>10s}{:>10s}{:>10s} |{:>7s}{:>10s}{:>10s}'.format(
+                    'scenario', 'presses', 'p50 (ms)', 'p95', 'p99', 'max',
+                    'spawns', 'p50 (ms)', 'max')]
+        for name in self.args.scenarios:
+            lat = [1000*l for l in self.latencies.get(name, [])]
+            spawns = [1000*s for s in self.spawns.get(name, [])]
+            lines.append('{:<10s}{:>7d}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f} |{:>7d}{:>10.1f}{:>10.1f}'.format(
+                name, len(lat), percentile(lat, 50), percentile(lat, 95), percentile(lat, 99),
+                max(lat, default=float('nan')),
+                len(spawns), percentile(spawns, 50), max(spawns, default=float('nan'))))
+        return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MASSS click-to-play latency benchmark')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='fake')
+    parser.add_argument('--fake-options', default='',
+                        help='options for fakevlc.py, with the fake backend (see `fakevlc.py --help`)')
+    parser.add_argument('--file', default=None,
+                        help='the file to play (default: a generated silent wav file)')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='number of presses for the warm and eq scenarios (default: 20)')
+    parser.add_argument('--repeat-cold', type=int, default=5,
+                        help='number of presses (and pools) for the cold and warmup scenarios (default: 5)')
+    parser.add_argument('--min-idle', type=int, default=2)
+    parser.add_argument('--max-idle', type=int, default=4)
+    parser.add_argument('--max-total', type=int, default=32)
+    parser.add_argument('--max-spawning', type=int, default=8)
+    parser.add_argument('--output', default=None, help='also write the report to this file')
+    args = parser.parse_args()
+
+    FakeVlcInstance.fake_options = shlex.split(args.fake_options)
+    generated = args.file is None
+    if generated:
+        args.file = make_silence()
+
+    bench = Bench(args)
+    try:
+        bench.loop.run_until_complete(bench.run())
+    finally:
+        if generated:
+            os.remove(args.file)
+    report = bench.report()
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report+'\n')
+
+if __name__ == "__main__":
+    main()
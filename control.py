@@ -0,0 +1,327 @@
+#!/bin/false
+
+# the control surface of MASSS: everything that plays sounds (the Tk UI, a lighting console script, another
+# operator station...) goes through a Controller, which lives in the event loop's thread with VlcInterface.
+# the Controller numbers the voices, and tells its subscribers when they start and stop.
+#
+# ControlServer exposes it on a local socket (unix socket or TCP), with a JSON-lines protocol:
+# each request is one JSON object on one line, and gets one answer line with the same "id":
+#   {"id": 1, "cmd": "play", "path": "drums/kick.wav"}   ->  {"id": 1, "ok": true, "voice": 3}
+#   {"id": 2, "cmd": "stop", "voice": 3}                 ->  {"id": 2, "ok": true}
+#   {"id": 3, "cmd": "nope"}                             ->  {"id": 3, "ok": false, "error": "unknown command: nope"}
+# commands:
+#   play {path, skip (seconds, optional: from the filename by default), vol (volume modifier, optional)}
+#       -> {voice} (voice is null if no instance was available). paths are relative to the sounds directory
+#   stop {voice}    voice_vol {voice, value}    vol {value} (master volume, 1.0 is 100%)
+#   eq {bands} (10 gains in dB, as a list or a string)    skip {seconds} (skip override, null to disable)
+#   hot {path, on (true or false)} -> {hot}: keeps a sound ready to play (see VlcInterface.set_hot)
+#   status -> {voices, hot, pool}    subscribe / unsubscribe (to the events)    ping
+# events are lines without "id": {"event": "started"|"stopped", "voice", "path"}, {"event": "vol", "value"},
+# {"event": "eq", "bands"}, {"event": "hot", "path", "on"}, {"event": "library", "dirs"} (directories whose listing changed).
+# play answers come once the track is sent to its player: other requests of the same client are answered meanwhile.
+
+import os
+import json
+import socket
+import asyncio as aio
+from library import parse_skip
+
+MAX_LINE = 65536  # bytes in a request
+MAX_BACKLOG = 2**20  # bytes of answers and events a client may leave unread before being disconnected
+
+
+def parse_address(address):
+    """'unix:/path/to/socket', 'tcp:host:port', 'host:port' or 'port' (on localhost) ->
+    ('unix', path) or ('tcp', host, port)"""
+    if address.startswith('unix:'):
+        return ('unix', address[5:])
+    if address.startswith('tcp:'):
+        address = address[4:]
+    host, _, port = address.rpartition(':')
+    return ('tcp', host or '127.0.0.1', int(port))
+
+
+class Controller:
+    def __init__(self, interface, library):
+        self.interface = interface
+        self.library = library
+        self.loop = interface.loop
+        self.voices = {}  # voice number -> (VlcInterface's id, path)
+        self.voice_count = 0
+        self.subscribers = []  # functions called with each event (a dict)
+        interface.on_hot = self.on_hot
+
+    def call(self, function, *args):
+        """calls function(*args) in the event loop's thread (from any thread)"""
+        self.loop.call_soon_threadsafe(function, *args)
+
+    def subscribe(self, function):
+        self.subscribers.append(function)
+
+    def unsubscribe(self, function):
+        if function in self.subscribers:
+            self.subscribers.remove(function)
+
+    def publish(self, event):
+        for function in list(self.subscribers):
+            function(event)
+
+    def relpath(self, path):
+        """the path of a sound, relative to the sounds directory (as the clients know it)"""
+        return os.path.relpath(path, self.library.root).replace(os.sep, '/')
+
+    # ## commands
+    async def play(self, path, skip=None, on_stop=None, press_id=None):
+        """plays a file. returns the number of its voice, or None if it could not be played.
+        `on_stop()` is called (in the event loop's thread) when it stops"""
+        self.voice_count += 1
+        voice = self.voice_count
+        is_started = False
+
+        def on_voice_stop():
+            self.voices.pop(voice, None)
+            if is_started:
+                self.publish({'event': 'stopped', 'voice': voice, 'path': self.relpath(path)})
+            if on_stop is not None:
+                on_stop()
+
+        id = await self.interface.play(path, skip, on_voice_stop, press_id)
+        if id is None:
+            return None
+        inter = self.interface
+        if inter.pool.get(id) is None and id not in inter.mixer_voices and id not in inter.hot_voices:
+            return voice  # already over (a very short track)
+        is_started = True
+        self.voices[voice] = (id, path)
+        self.publish({'event': 'started', 'voice': voice, 'path': self.relpath(path)})
+        return voice
+
+    def stop(self, voice):
+        if voice in self.voices:
+            self.interface.stop(self.voices[voice][0])  # (the stopped event comes from on_voice_stop)
+
+    def set_vol_mod(self, voice, v):
+        if voice in self.voices:
+            self.interface.set_vol_mod(self.voices[voice][0], v)
+
+    def vol(self, v):
+        self.interface.vol(v)
+        self.publish({'event': 'vol', 'value': v})
+
+    def eq(self, bands):
+        """`bands` is the equalizer string: the 10 gains, separated by spaces"""
+        self.interface.eq(bands)
+        self.publish({'event': 'eq', 'bands': [float(gain) for gain in bands.split()]})
+
+    def set_hot(self, path, is_hot):
+        """makes a sound hot (or not). returns whether it is hot now"""
+        return self.interface.set_hot(path, parse_skip(os.path.basename(path)), is_hot)
+
+    def on_hot(self, path, is_hot):
+        self.publish({'event': 'hot', 'path': self.relpath(path), 'on': is_hot})
+
+    def set_skip_override(self, skip):
+        self.interface.skip_override = skip
+
+    def library_changed(self, changed):
+        self.publish({'event': 'library', 'dirs': sorted(reldir.replace(os.sep, '/') for reldir in changed)})
+
+    def status(self):
+        inter = self.interface
+        return {'voices': [{'voice': voice, 'path': self.relpath(path)} for voice, (_, path) in self.voices.items()],
+                'hot': [{'path': self.relpath(path), 'cued': hot.is_cued} for path, hot in inter.hot.items()],
+                'pool': {'instances': len(inter.pool), 'idle': inter.count_idle(),
+                         'loading': len(inter.loading_instances), 'mixer_voices': len(inter.mixer_voices)}}
+
+    def quit(self):
+        self.interface.startFinalization()
+
+
+class CommandError(Exception):
+    """a request which can't be done: its message is sent to the client"""
+
+
+# ## the control socket
+class ControlServer:
+    def __init__(self, controller, address):
+        """`address` is parsed by parse_address"""
+        self.controller = controller
+        self.loop = controller.loop
+        self.address = parse_address(address)
+        self.server = None
+        self.clients = set()  # ControlClient
+        self.plays = set()  # tasks of the play requests being done (kept here: they outlive their client)
+        self.root = os.path.realpath(controller.library.root)
+
+    async def start(self):
+        try:
+            if self.address[0] == 'unix':
+                if os.path.exists(self.address[1]):
+                    os.remove(self.address[1])  # left by a previous run
+                self.server = await aio.start_unix_server(self.onConnect, self.address[1], limit=MAX_LINE)
+            else:
+                self.server = await aio.start_server(self.onConnect, self.address[1], self.address[2], limit=MAX_LINE)
+        except OSError as err:
+            print('warning: cannot open the control socket {}: {}'.format(self.address[1:], err))
+            return
+        print('control socket listening at', ':'.join(str(part) for part in self.address))
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+            if self.address[0] == 'unix':
+                try:
+                    os.remove(self.address[1])
+                except OSError:
+                    pass
+        for client in list(self.clients):
+            client.close()
+
+    async def onConnect(self, reader, writer):
+        sock = writer.get_extra_info('socket')
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # answers go out right away
+        client = ControlClient(self, reader, writer)
+        self.clients.add(client)
+        try:
+            await client.run()
+        finally:
+            client.close()
+            self.clients.discard(client)
+
+    def sound_path(self, path):
+        """the path of a sound (as the library and the UI write it), from its path relative to the sounds directory.
+        only the files of the sounds directory can be played"""
+        if not isinstance(path, str):
+            raise CommandError('path must be a string')
+        full = os.path.realpath(os.path.join(self.root, path))
+        if os.path.commonpath([full, self.root]) != self.root or not os.path.isfile(full):
+            raise CommandError('no such sound: {:s}'.format(path))
+        relpath = os.path.relpath(full, self.root)
+        return self.controller.library.path(os.path.dirname(relpath), os.path.basename(relpath))
+
+
+class ControlClient:
+    """one connection to the control socket"""
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.controller = server.controller
+        self.reader = reader
+        self.writer = writer
+        self.is_subscribed = False
+        self.is_closed = False
+
+    async def run(self):
+        while not self.is_closed:
+            try:
+                line = await self.reader.readline()
+            except (ValueError, aio.LimitOverrunError):  # too long: can't be parsed anyway
+                self.send({'ok': False, 'error': 'request too long'})
+                return
+            except OSError:
+                return
+            if not line:
+                return
+            if line.strip():
+                self.onRequest(line)
+
+    def onRequest(self, line):
+        try:
+            request = json.loads(line.decode())
+            if not isinstance(request, dict):
+                raise ValueError('a request is a JSON object')
+        except ValueError as err:
+            self.send({'ok': False, 'error': 'bad request: {}'.format(err)})
+            return
+        id = request.get('id')
+        command = request.get('cmd')
+        try:
+            if command == 'play':  # the only slow one: don't hold the other requests
+                # it goes on if the client leaves meanwhile: only its answer is lost
+                task = self.server.loop.create_task(self.play(id, request))
+                self.server.plays.add(task)
+                task.add_done_callback(self.server.plays.discard)
+                return
+            handler = getattr(self, 'cmd_' + str(command), None)
+            if handler is None:
+                raise CommandError('unknown command: {}'.format(command))
+            answer = handler(request) or {}
+        except CommandError as err:
+            answer = {'ok': False, 'error': str(err)}
+        except (KeyError, TypeError, ValueError) as err:
+            answer = {'ok': False, 'error': 'bad arguments: {!r}'.format(err)}
+        self.send(dict({'id': id, 'ok': True}, **answer))
+
+    def send(self, message):
+        if self.is_closed:
+            return
+        self.writer.write(json.dumps(message).encode() + b'\n')
+        if self.writer.transport.get_write_buffer_size() > MAX_BACKLOG:
+            print('warning: a control client does not read its messages, disconnecting it')
+            self.close()
+
+    def close(self):
+        if self.is_closed:
+            return
+        self.is_closed = True
+        self.controller.unsubscribe(self.send)
+        self.writer.close()
+
+    # ## commands. they return the fields of the answer (besides 'id' and 'ok')
+    async def play(self, id, request):
+        try:
+            path = self.server.sound_path(request['path'])
+            skip = request.get('skip')
+            if skip is None:
+                skip = parse_skip(os.path.basename(path))  # from the filename, as for the buttons
+            else:
+                skip = float(skip)
+            voice = await self.controller.play(path, skip)
+            if voice is not None and request.get('vol') is not None:
+                self.controller.set_vol_mod(voice, float(request['vol']))
+            self.send({'id': id, 'ok': True, 'voice': voice})
+        except CommandError as err:
+            self.send({'id': id, 'ok': False, 'error': str(err)})
+        except (KeyError, TypeError, ValueError) as err:
+            self.send({'id': id, 'ok': False, 'error': 'bad arguments: {!r}'.format(err)})
+
+    def cmd_stop(self, request):
+        self.controller.stop(request['voice'])
+
+    def cmd_voice_vol(self, request):
+        self.controller.set_vol_mod(request['voice'], float(request['value']))
+
+    def cmd_vol(self, request):
+        self.controller.vol(float(request['value']))
+
+    def cmd_eq(self, request):
+        bands = request['bands']
+        if isinstance(bands, str):
+            bands = bands.split()
+        if len(bands) != 10:
+            raise CommandError('the equalizer has 10 bands')
+        self.controller.eq(' ' + ''.join('{:g} '.format(float(gain)) for gain in bands))
+
+    def cmd_hot(self, request):
+        path = self.server.sound_path(request['path'])
+        return {'hot': self.controller.set_hot(path, bool(request.get('on', True)))}
+
+    def cmd_skip(self, request):
+        seconds = request.get('seconds')
+        self.controller.set_skip_override(None if seconds is None else float(seconds))
+
+    def cmd_status(self, request):
+        return self.controller.status()
+
+    def cmd_subscribe(self, request):
+        if not self.is_subscribed:
+            self.controller.subscribe(self.send)
+            self.is_subscribed = True
+
+    def cmd_unsubscribe(self, request):
+        self.controller.unsubscribe(self.send)
+        self.is_subscribed = False
+
+    def cmd_ping(self, request):
+        pass
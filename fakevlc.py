@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# a fake vlc program, which speaks (a small part of) the rc interface protocol and plays nothing.
+# tracks just "end" once their length is elapsed.
+# it is used to run, test and measure the instance pool headless, for example:
+#     python3 MASSS.py --backend fake --fake-options "--fake-startup-delay 0.5 --fake-crash-rate 0.01"
+# it takes the same options as vlc (and ignores most of them), plus the --fake-* options below.
+
+import sys
+import os
+import argparse
+import random
+import wave
+import asyncio as aio
+from time import monotonic as time
+
+GREETING = 'VLC media player 3.0.0 Vetinari (fake)\r\n' \
+           "Command Line Interface initialized. Type `help' for help.\r\n"
+PROMPT = '> '
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='headless stand-in for `vlc -I rc`')
+    parser.add_argument('-I', dest='interface', default='rc')
+    parser.add_argument('--rc-host', default='127.0.0.1:9000')
+    parser.add_argument('--rc-unix', default=None, help='listen on this unix socket instead of --rc-host')
+    parser.add_argument('--fake-startup-delay', type=float, default=0.0,
+                        help='seconds to wait before accepting connections')
+    parser.add_argument('--fake-latency', type=float, default=0.0,
+                        help='seconds to wait before answering each command')
+    parser.add_argument('--fake-crash-after', type=int, default=None,
+                        help='crash when receiving the Nth command')
+    parser.add_argument('--fake-crash-rate', type=float, default=0.0,
+                        help='probability to crash when receiving a command')
+    parser.add_argument('--fake-length', type=float, default=3.0,
+                        help='length of the tracks (in seconds) which are not readable wav files')
+    parser.add_argument('--fake-log-rate', type=float, default=0.0,
+                        help='warnings printed per second while playing, like a chatty decoder')
+    parser.add_argument('--fake-seed', type=int, default=None,
+                        help='random seed, for reproducible crashes. it is mixed with the rc address, '
+                             'so that the instances of a pool (vlc0.sock, vlc1.sock...) draw different numbers')
+    args, _ = parser.parse_known_args(argv)  # ignore all the real vlc options
+    return args
+
+def media_length(filename):
+    """the length of a track: real length for wav files, --fake-length for anything else"""
+    try:
+        with wave.open(filename, 'rb') as file:
+            return file.getnframes() / file.getframerate()
+    except Exception:
+        return None
+
+
+class FakeVlc:
+    def __init__(self, args, loop):
+        self.args = args
+        self.loop = loop
+        if args.fake_seed is None:
+            self.rng = random.Random()
+        else:
+            address = os.path.basename(args.rc_unix) if args.rc_unix else args.rc_host
+            self.rng = random.Random('{:d}:{:s}'.format(args.fake_seed, address))
+        self.n_commands = 0
+        self.volume = 256
+        self.media = None
+        self.length = 0.0
+        self.state = 'stop'  # 'play', 'pause' or 'stop'
+        self.position = 0.0  # position when the track was last paused/seeked
+        self.position_time = 0.0  # time at which self.position was valid
+        self.end_token = None
+        self.writers = []
+        self.done = aio.Event()
+
+    # ## output
+    def write(self, text):
+        for writer in self.writers:
+            writer.write(text.encode())
+
+    def status(self, text):
+        self.write('status change: ( {:s} )\r\n'.format(text))
+
+    # ## fake playback
+    def get_position(self):
+        if self.state == 'play':
+            return self.position + time() - self.position_time
+        return self.position
+
+    def set_position(self, position):
+        self.position = max(0.0, min(position, self.length))
+        self.position_time = time()
+        self.schedule_end()
+
+    def schedule_end(self):
+        if self.end_token is not None:
+            self.end_token.cancel()
+            self.end_token = None
+        if self.state == 'play':
+            self.end_token = self.loop.call_later(max(0.0, self.length-self.position), self.on_end)
+
+    def set_state(self, state):
+        self.position = self.get_position()
+        self.position_time = time()
+        self.state = state
+        self.schedule_end()
+        self.write('status change: ( {:s} state: {:d} ): {:s}\r\n'.format(
+            state, {'play': 3, 'pause': 4, 'stop': 5}[state], state.capitalize()))
+
+    def on_end(self):
+        self.end_token = None
+        self.position = self.length
+        self.set_state('stop')
+
+    # ## commands
+    def cmd_add(self, arg):
+        # like vlc: the options start at the first ' :' (so the file names can contain spaces)
+        words = [word.strip() for word in arg.split(' :')]
+        words[1:] = [':'+word for word in words[1:]]
+        if not words[0]:
+            return
+        self.media = words[0]
+        self.length = media_length(self.media)
+        if self.length is None:
+            self.length = self.args.fake_length
+        start = 0.0
+        paused = False
+        for option in words[1:]:
+            if option.startswith(':start-time='):
+                start = float(option.split('=', 1)[1])
+            elif option == ':start-paused':
+                paused = True
+        self.status('new input: file://{:s}'.format(os.path.abspath(self.media)))
+        self.position = min(start, self.length)
+        self.set_state('pause' if paused else 'play')
+
+    def cmd_seek(self, arg):
+        if self.media is not None:
+            self.set_position(float(arg))
+
+    def cmd_volume(self, arg):
+        if arg:
+            self.volume = int(arg)
+            self.status('audio volume: {:d}'.format(self.volume))
+        else:
+            self.write('{:d}\r\n'.format(self.volume))
+
+    def cmd_get_length(self, arg):
+        self.write('{:d}\r\n'.format(int(self.length) if self.media else 0))
+
+    def cmd_get_time(self, arg):
+        self.write('{:d}\r\n'.format(int(self.get_position()) if self.media else 0))
+
+    def cmd_stop(self, arg):
+        if self.state != 'stop':
+            self.set_state('stop')
+
+    def cmd_pause(self, arg):
+        if self.state == 'play':
+            self.set_state('pause')
+        elif self.state == 'pause':
+            self.set_state('play')
+
+    def cmd_play(self, arg):
+        if self.state == 'pause':
+            self.set_state('play')
+        elif self.state == 'stop' and self.media is not None:
+            self.position = 0.0
+            self.set_state('play')
+
+    def cmd_shutdown(self, arg):
+        self.write('Shutting down.\r\n')
+        self.done.set()
+
+    def execute(self, line):
+        cmd, _, arg = line.strip().partition(' ')
+        if not cmd:
+            return
+        method = getattr(self, 'cmd_'+cmd, None)
+        if method is None:
+            self.write("Unknown command `{:s}'. Type `help' for help.\r\n".format(cmd))
+        else:
+            method(arg.strip())
+
+    async def handle_client(self, reader, writer):
+        self.writers.append(writer)
+        writer.write((GREETING+PROMPT).encode())
+        try:
+            while not self.done.is_set():
+                line = await reader.readline()
+                if not line:
+                    break
+                self.n_commands += 1
+                if self.args.fake_crash_after is not None and self.n_commands >= self.args.fake_crash_after \
+                        or self.rng.random() < self.args.fake_crash_rate:
+                    print('fake vlc: crashing on purpose at command', self.n_commands, flush=True)
+                    os._exit(1)
+                if self.args.fake_latency:
+                    await aio.sleep(self.args.fake_latency)
+                self.execute(line.decode(errors='replace'))
+                writer.write(PROMPT.encode())
+                await writer.drain()
+        finally:
+            self.writers.remove(writer)
+            writer.close()
+
+    async def chatter(self):
+        """prints warnings while playing, the way vlc does"""
+        while True:
+            await aio.sleep(1 / self.args.fake_log_rate)
+            if self.state == 'play':
+                print('[00007f0000000000] main decoder warning: fake warning at {:.3f}'.format(self.get_position()),
+                      flush=True)
+
+    async def run(self):
+        if self.args.fake_log_rate > 0:
+            self.loop.create_task(self.chatter())
+        await aio.sleep(self.args.fake_startup_delay)
+        if self.args.rc_unix is not None:
+            server = await aio.start_unix_server(self.handle_client, self.args.rc_unix)
+        else:
+            host, _, port = self.args.rc_host.rpartition(':')
+            server = await aio.start_server(self.handle_client, host or '127.0.0.1', int(port))
+        print('fake vlc: listening on', self.args.rc_unix or self.args.rc_host, flush=True)
+        await self.done.wait()
+        server.close()
+        if self.args.rc_unix is not None:
+            os.remove(self.args.rc_unix)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    loop = aio.get_event_loop()
+    try:
+        loop.run_until_complete(FakeVlc(args, loop).run())
+    except OSError as err:  # just like vlc, which can't do anything without its socket
+        print('fake vlc: cannot listen on', args.rc_unix or args.rc_host, ':', err, flush=True)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
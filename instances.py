@@ -1,10 +1,37 @@
 import sys
 import os
 from time import monotonic as time
-from socket import socket
 import subprocess as sb
-from select import select
+import re
 import asyncio as aio
+import socket
+import tempfile
+import shutil
+import atexit
+import itertools
+from collections import deque
+from abc import ABC, abstractmethod
+from rcclient import RcClient
+from metrics import REGISTRY
+from tracer import TRACER, current_press
+
+START_TIMEOUT = 10  # seconds for vlc to open its rc interface
+WATCHDOG_MARGIN = 2.0  # seconds after the end of a track, if vlc didn't tell us it ended
+
+OUTPUT_LINES = 200  # last lines of a vlc's output kept in memory (shown if it crashes)
+
+state_detector = re.compile(r'\( (?P<state>[a-z]+) state: ')
+# vlc's log lines: "[00007f1c2c000c80] main input error: ..."
+output_detector = re.compile(r'\[[0-9a-fA-F]+\] (?P<source>.+?) (?P<level>error|warning): (?P<message>.*)')
+
+VLC_MESSAGES = REGISTRY.counter('masss_vlc_messages', 'warnings and errors printed by the vlc instances', ['level'])
+
+if sys.platform == 'win32':
+    # vlc is started with asyncio's subprocesses: on windows, only the proactor event loop has them
+    if hasattr(aio, 'WindowsProactorEventLoopPolicy'):  # python >= 3.7
+        aio.set_event_loop_policy(aio.WindowsProactorEventLoopPolicy())
+    else:
+        aio.set_event_loop(aio.ProactorEventLoop())
 
 
 # ## helper functions
@@ -37,18 +64,28 @@ def get_params(dict):
             res.append(temp)
     return res
 
-def port_increment(port):
-    port_start = 8990
-    port_end = 9089
-    if port != port_end:  # cycle between 8990 and 9089 ports
-        return port + 1
-    else:
-        return port_start
+_socket_dir = None  # temporary directory for the rc sockets, created on first use
+_socket_count = itertools.count()
+
+def rc_address():
+    """a new address for the rc interface of a vlc: the path of a unix socket where possible,
+    a free port on localhost (chosen by the OS) otherwise"""
+    global _socket_dir
+    if hasattr(socket, 'AF_UNIX') and sys.platform != 'win32':
+        if _socket_dir is None:
+            _socket_dir = tempfile.mkdtemp(prefix='masss-')
+            atexit.register(shutil.rmtree, _socket_dir, True)
+        return os.path.join(_socket_dir, 'vlc{:d}.sock'.format(next(_socket_count)))
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
 
-# the vlc instance class itself.
+# the playback backend interface.
 # more like an evolved struct: attributes will be accessed by VlcInterface
-class VlcInstance:
-    def __init__(self, port, eq_cache, vol_cache, loop):
+class BaseInstance(ABC):
+    """one voice of the pool: plays one track at a time.
+    `start_task` is the coroutine starting the instance, or None once it is ready to play"""
+    def __init__(self, eq_cache, vol_cache, loop):
         self.loop = loop
         self.stop_token = None
         self.is_dirty = False  # used extarnally
@@ -57,102 +94,246 @@ class VlcInstance:
         self.vol_cache = vol_cache
         self.term_attempts = 0  # used for cleaning
         self.term_time = 0
-
-        start_task = self.loop.create_task(self.start(port, eq_cache))
-        self.start_task = start_task
+        self.on_stop = None
+        self.on_broken = None  # called with the instance when it finds out that it is broken (set by VlcInterface)
+        self.is_terminating = False
+        self.start_task = None
+        self.slot = None  # its place in VlcInterface's pool (see pool.InstancePool)
+        # timing information (monotonic times), for measures
+        self.creation_time = time()
+        self.spawn_duration = None  # how long it took to be ready to play
+        self.add_time = None  # when the last track was sent to vlc (written to its socket, for the rc backend)
+        # tracing (see tracer.py): the press which started the current track, and the span of the track
+        self.press = None
+        self.track_span = None
 
     async def ensure_started(self):
         if self.start_task is not None:
             print("warning: a VLC instance is used before its full initialisation.")
-            await self.start_task
+            # (shielded: if the caller is cancelled, the instance goes on starting for the pool)
+            await aio.shield(self.start_task)
+
+    @abstractmethod
+    async def play(self, filename, skip, on_stop, length=None):
+        """starts playing `filename` (skipping the first `skip` seconds if not None; can be a float).
+        `on_stop` is called when it stops. `length` is the length of the track in seconds, if it is known"""
+
+    @abstractmethod
+    async def cue(self, filename, skip):
+        """loads a track, paused at its start (after `skip` seconds), so that resume() plays it right away"""
+
+    @abstractmethod
+    async def resume(self, on_stop, length=None):
+        """plays the track loaded by cue(). same as play() otherwise"""
+
+    @abstractmethod
+    def stop(self, event=None):
+        """stops the track, and calls its on_stop callback"""
+
+    @abstractmethod
+    def vol(self, v=None):
+        """sets the master volume to `v`, or refreshes the real volume after a vol_modifier change if None"""
+
+    def set_eq(self, eq_cache):
+        """applies a new equalizer, if it can be done without restarting the instance.
+        returns False if the instance has to be replaced to use it"""
+        return False
+
+    @abstractmethod
+    def terminate(self):
+        """starts closing the instance. check_termination tells when it is done"""
+
+    @abstractmethod
+    def check_termination(self):
+        """returns True once the terminated instance is completely gone. can be called repeatedly"""
+
+    @abstractmethod
+    def terminate_broken(self):
+        """same as terminate(), for an instance which crashed or can't be talked to anymore"""
+
+    @abstractmethod
+    def is_cleanable(self, event=None):
+        """returns True (and terminates the instance) if it is broken.
+        (obselete instances, with an old equalizer, are replaced by VlcInterface.clean__rebuild)"""
+
+
+# the vlc instance class itself: a `vlc -I rc` process, controlled through a socket
+class VlcInstance(BaseInstance):
+    def __init__(self, eq_cache, vol_cache, loop):
+        BaseInstance.__init__(self, eq_cache, vol_cache, loop)
+        self.rc = None
+        self.vlc = None  # the vlc process (an asyncio.subprocess.Process), once it is launched
+        # vlc's output is read all the time: if nobody reads it, vlc blocks once the pipe is full
+        self.output = deque(maxlen=OUTPUT_LINES)
+        self.output_changed = aio.Event()  # set when a line is read
+        self.output_closed = False  # set when vlc closed its output (it exited)
+        self.output_task = None
+        self.is_broken = False  # set when the connection broke, or vlc exited, while it was not terminated
+        self.address = rc_address()  # unix socket path (str) or localhost port (int) of the rc interface
+        self.started = aio.Event()  # set when vlc says that the last track started playing
+        self.paused = aio.Event()  # set when vlc says that it paused (a cued track is ready)
+        self.cued = None  # (filename, skip) of the track loaded by cue()
+
+        start_task = self.loop.create_task(self.start(eq_cache))
+        # its error (already printed) is not always awaited: don't complain about it
+        start_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        self.start_task = start_task
 
-    async def start(self, port, eq_cache):
+    def get_command(self):
+        """returns the program to launch, as a list, and its working directory"""
         program, cwd = get_vlc_prgrm()
+        return [program], cwd
+
+    async def start(self, eq_cache):
+        program, cwd = self.get_command()
         args = {}
         args['--audio-filter']= "equalizer"
         args["--no-equalizer-2pass"] = None
         args["--equalizer-preamp"] = '12'
         args['--equalizer-bands'] = '"{:s}"'.format(eq_cache)
+        args["-I"] = "rc"
+        if isinstance(self.address, str):
+            args["--rc-unix"] = self.address
+        else:
+            args["--rc-host"] = "127.0.0.1:{:d}".format(self.address)
 
-        for i in range(99):
-            args["-I"] = "rc"
-            args["--rc-host"]="127.0.0.1:{:d}".format(port)
-            # arg2 = ["-I cli", "--lua-config=\"cli={{host='localhost:{:d}'}}\"".format(port)]
-
-            cmd = [program] + get_params(args)
-            print(cmd)
+        cmd = program + get_params(args)
+        print(cmd)
+        # asyncio's subprocesses: starting vlc doesn't block the event loop, so several can start at once
+        try:
             if sys.platform == 'linux':
-                self.vlc = sb.Popen(cmd, stdout=sb.PIPE, stderr = sb.STDOUT, shell=False)
+                self.vlc = await aio.create_subprocess_exec(*cmd, stdout=sb.PIPE, stderr=sb.STDOUT, cwd=cwd)
             else:
-                self.vlc = sb.Popen(cmd, stdout=sb.PIPE, stderr = sb.STDOUT, shell=False, creationflags=sb.SW_HIDE)  # extra windows window management flag
+                self.vlc = await aio.create_subprocess_exec(*cmd, stdout=sb.PIPE, stderr=sb.STDOUT, cwd=cwd,
+                                                            creationflags=sb.SW_HIDE)  # extra windows window management flag
+        except (OSError, NotImplementedError) as err:  # no vlc there, or no subprocesses in this event loop
+            print('vlc could not be launched:', err)
+            raise OSError(err)
+        self.output_task = self.loop.create_task(self.read_output())
+        try:
+            reader, writer = await self.connect()
+        except aio.CancelledError:  # terminated while starting: don't leave vlc behind
             try:
-                # self.vlc.stdout.readlines(2)  # will wait for vlc to initialize
-                # second line says 'listening' (fail)
-                i = 0  # wait at most two seconds (for very slow machines)
-                await aio.sleep(0.08)
-                while True:
-                    try:
-                        self.sock = socket()
-                        await self.loop.sock_connect(self.sock, ('127.0.0.1', port))
-                        break
-                    except:
-                        print('waiting ', i)
-                        if i > 10:
-                            raise
-                        await aio.sleep(0.2)
-                        i += 1
-                self.port = port
-                break  # on success
-            except Exception as err:
-                print('failed.')
-                print('|', err)
                 self.vlc.kill()
-                print('|', self.vlc.stdout.read().decode().replace('\n', '\n |'))
-                port = port_increment(port)
-        else:  # failed all 99 times (no break):
-            raise RuntimeError('failed to connect to all 99 ports.')
+            except ProcessLookupError:
+                pass
+            raise
+        except Exception as err:
+            print('vlc failed to start.')
+            print('|', err)
+            try:
+                self.vlc.kill()
+            except ProcessLookupError:
+                pass  # already gone
+            await aio.wait([self.output_task], timeout=1)  # its last words
+            self.dump_output()
+            raise
 
-        print('vlc started at port', self.port, '(output displayed, but no input is possible here in the console)')
+        self.rc = RcClient(reader, writer, self.loop, self.on_status, self.on_connection_lost)
+        await self.rc.wait_greeting()
+        print('vlc started at', self.address)
         # set new instance volume
         self.vol()
+        self.spawn_duration = time() - self.creation_time
         self.start_task = None
 
+    async def connect(self):
+        """connects to the rc interface, once vlc is listening. returns the reader and writer streams"""
+        # the address is ours alone: no other program can be listening there. so no need to try other addresses,
+        # just wait for vlc. (a while: starting many at once on a slow machine takes time)
+        # vlc is ready when it can be connected to: try again each time it prints something
+        # (it is making progress), or after a growing delay otherwise.
+        end = time() + START_TIMEOUT
+        delay = 0.01
+        while True:
+            try:
+                if isinstance(self.address, str):
+                    return await aio.open_unix_connection(self.address)
+                return await aio.open_connection('127.0.0.1', self.address)
+            except OSError:
+                pass
+            if self.output_closed:  # vlc exited
+                await self.vlc.wait()
+                raise ConnectionRefusedError('vlc exited with code {:d}'.format(self.vlc.returncode))
+            if time() > end:
+                raise TimeoutError('vlc did not open its rc interface at {}'.format(self.address))
+            self.output_changed.clear()
+            try:
+                await aio.wait_for(self.output_changed.wait(), delay)
+            except aio.TimeoutError:
+                delay = min(2*delay, 0.2)
+
+    async def read_output(self):
+        """reads vlc's output until it exits, keeping its last lines"""
+        try:
+            while True:
+                try:
+                    line = await self.vlc.stdout.readline()
+                except ValueError:  # a line too long to be kept: it was skipped
+                    continue
+                if not line:
+                    break
+                line = line.decode(errors='replace').rstrip()
+                self.output.append(line)
+                self.on_output(line)
+                self.output_changed.set()
+        finally:
+            self.output_closed = True
+            self.output_changed.set()
+            if self.rc is not None and (self.is_broken or not self.is_terminating):
+                # vlc crashed (or had to be killed): its last words may tell why
+                print('vlc', self.vlc.pid, 'exited.')
+                self.dump_output()
+                if self.rc.error is None:  # (its connection may have broken first)
+                    self.rc.fail(ConnectionResetError('vlc exited'))
+
+    def on_output(self, line):
+        """called for each line printed by vlc"""
+        found = output_detector.search(line)
+        if found is None:
+            return
+        VLC_MESSAGES.labels(found.group('level')).inc()
+        if found.group('level') == 'error':
+            print('vlc error ({:s}): {:s}'.format(found.group('source'), found.group('message')))
+
+    def dump_output(self):
+        """prints the last lines of vlc's output"""
+        print('| last output of vlc:' if self.output else '| (vlc printed nothing)')
+        for line in self.output:
+            print('|', line)
+
     def terminate(self):
+        self.is_terminating = True
         if self.start_task:  # this instance is terminated before it could finish...
             self.start_task.cancel()
-        try:
-            self.sock.send(b'shutdown\n')
-            self.sock.close()
-        except Exception:
-            pass  # if something breaks here, it will be cleaned later on anyway
+        if self.rc is not None:
+            try:
+                self.rc.send('shutdown')
+                self.rc.close()
+            except OSError:  # the connection is broken (or stalled): check_termination will kill vlc
+                self.rc.abort()
         self.term_time = time()
         self.term_attempts = 1
 
     def is_cleanable(self, event=None):
-        r_flag, _ , exc_flag = select([self.sock], [], [self.sock], 0)
-        if r_flag:  # something to read in socket
-            print(self.sock.recv(256).decode()
-                  .replace('\r\n', '\n').replace('\n> ','').replace('> ','').strip())
-            # print output (without the input prompts)
-        if exc_flag:  # if VLC cut the connection (crashed)
-            self.terminate_broken()
-            return True
-        if (self.is_dirty and not self.is_playing):  # if it became obselete
-            self.terminate()
+        if self.rc.error is not None:  # if VLC cut the connection (crashed)
+            print('vlc', self.vlc.pid, 'broke its connection:', self.rc.error)
+            self.terminate_broken()  # (its output is printed once it exits)
             return True
-        else:
-            return False
+        return False
 
     def check_termination(self):
-        if self.vlc.poll() is not None:
+        if self.vlc is None or self.vlc.returncode is not None:  # (never launched, or gone)
+            self.remove_socket()
             return True
-        else:
+        try:
             # semi-gentle timeout 1s
             # hard timeout 3s
             # zombie killer timeout 5s
             if time() > self.term_time +5 and self.term_attempts > 2:
                 print("Warning: zombie vlc", self.vlc.pid, 'has to be taken down')
                 os.kill(self.vlc.pid, 9)
+                self.remove_socket()
                 return True
             if time() > self.term_time +3 and self.term_attempts > 1:
                 print('Warning: vlc instance', self.vlc.pid, 'had to be killed.')
@@ -163,15 +344,23 @@ class VlcInstance:
                 self.vlc.terminate()
                 self.term_attempts = 2
                 return False
+        except ProcessLookupError:  # it just exited
+            return False
+
+    def remove_socket(self):
+        if isinstance(self.address, str):
+            try:
+                os.remove(self.address)
+            except OSError:
+                pass  # vlc removed it itself
 
     def terminate_broken(self):
-        if self.vlc.poll() is not None:
-            # vlc has crashed. Nothing much to do.
-            self.sock.close()
-        else:
-            # pipe was somehow broken without vlc crashing. close it the regular way.
-            # (at the next use of check_termination.)
-            pass
+        self.is_broken = True
+        self.is_terminating = True
+        # if vlc has crashed, nothing much to do. if the pipe was somehow broken without vlc crashing,
+        # it is closed the regular way (at the next use of check_termination)
+        if self.rc is not None:
+            self.rc.abort()
         self.term_time = time()
         self.term_attempts = 1
 
@@ -180,50 +369,124 @@ class VlcInstance:
             self.vol_cache = v
         # None is for updating vlc only
         true_vol = int(self.vol_cache * 256 *self.vol_modifier)
-        self.sock.send( 'volume {:d}\n'.format(true_vol) .encode() )
+        self.rc.send('volume {:d}'.format(true_vol))
 
-    async def play(self, filename, skip, on_stop):
+    def on_connection_lost(self, err):
+        """called by the rc client once its connection is broken: vlc crashed, most likely"""
+        if self.is_terminating:
+            return
+        self.is_broken = True
+        if self.on_broken is not None:
+            self.on_broken(self)  # (before the release: the instance is known as broken when its track stops)
+        if self.is_playing:
+            TRACER.instant('connection lost', self.press)
+            self.release()
+
+    def on_status(self, status):
+        """called by the rc client (from its reader task) for each status change of vlc"""
+        state = state_detector.match(status)
+        if state is None:
+            return
+        if state.group('state') == 'play':
+            self.started.set()
+        elif state.group('state') == 'pause':
+            self.paused.set()
+        elif state.group('state') == 'stop' and self.is_playing and self.started.is_set():
+            # end of the track. (the stop states seen before the track started are those of the previous one)
+            TRACER.instant('track ended', self.press)
+            self.release()
+
+    async def play(self, filename, skip, on_stop, length=None):
         if self.is_playing:
             print("warning: for some reason, a track was stopped in order to start a new one. Expect an audio glitch now.")
             self.stop()
-        self.sock.send('add {:s}\n'.format(filename).encode())
-        if skip is not None:
-            await aio.sleep(0.1)
-            self.sock.send('seek {:s}\n'.format(skip).encode())
+        self.is_playing=True  # set it right now, so concurrent play() calls don't pick this instance
         self.on_stop = on_stop
-        self.is_playing=True
-        await aio.sleep(0.02)
-        while select([self.sock],[],[],0)[0]:
-            self.sock.recv(512)  # this won't block because each call to vlc generates output
-        #sleep(0.8)
-        self.sock.send(b'get_length\n')
-        # response should be 't\n> ' where t is in seconds
-        response = await self.loop.sock_recv(self.sock, 256)
-        for line in response.decode().split('\n'):  # vlc might add logging lines. dodge those.
-            try:
-                length = int(line)
-                if length != 0:
-                    break
-                else: print('saw a zero for track length.')
-            except Exception: pass  # not the right line. next.
-        else:  # actually failed...
-            # try to be safe.
-            print('warning: track length wasn\'t returned correctly. button will not auto-deselect.')
-            return
+        self.started.clear()
+        self.press = current_press.get()
+        self.track_span = TRACER.begin('track', file=os.path.basename(filename))
+        command = 'add {:s}'.format(filename)
+        if skip:
+            # the track starts right at the offset: no seek, and no audible intro
+            command += ' :start-time={:g}'.format(skip)
+        self.add_time = None
+        answer = self.rc.send(command, self.on_written)
+        self.cued = None
+        self.arm_watchdog(length, skip)
+        await answer
 
+    async def cue(self, filename, skip):
+        self.cued = None
+        self.paused.clear()
+        command = 'add {:s} :start-paused'.format(filename)
         if skip:
-            length -= int(skip)
-        # after_func is the window.after tk function
-        self.stop_token = self.loop.call_later(length+0.5, self.stop)
+            command += ' :start-time={:g}'.format(skip)
+        await self.rc.send(command)
+        # vlc answers right away: wait for the track to be opened (and paused)
+        try:
+            await aio.wait_for(self.paused.wait(), START_TIMEOUT)
+        except aio.TimeoutError:
+            raise TimeoutError('vlc did not cue {:s}'.format(filename))
+        self.cued = (filename, skip)
+
+    async def resume(self, on_stop, length=None):
+        filename, skip = self.cued
+        self.cued = None
+        self.is_playing = True
+        self.on_stop = on_stop
+        self.started.clear()
+        self.press = current_press.get()
+        self.track_span = TRACER.begin('track', file=os.path.basename(filename), cued=True)
+        self.add_time = None
+        answer = self.rc.send('play', self.on_written)  # (unpauses)
+        self.arm_watchdog(length, skip)
+        await answer
+
+    def on_written(self):
+        self.add_time = time()
+
+    def arm_watchdog(self, length, skip):
+        # vlc tells us when the track ends (see on_status). just in case that message gets lost,
+        # the track is stopped a bit after its end, if its length is known.
+        if length is not None:
+            if skip:
+                length = max(0, length - skip)
+            self.stop_token = self.loop.call_later(length + WATCHDOG_MARGIN, self.auto_stop)
+
+    def auto_stop(self):
+        """the track should be over by now, but vlc didn't say so"""
+        self.stop_token = None
+        TRACER.instant('auto-stop', self.press)
+        try:
+            self.stop()
+        except OSError:
+            pass  # the track is released anyway, and the broken connection was reported (see on_connection_lost)
 
     def stop(self, event=None):
-        self.sock.send(b'stop\n')
+        try:
+            self.rc.send('stop')
+        finally:
+            self.release()
 
-        if self.stop_token is not None:  # hope after_cancel on an ongoing callback's id doesn't break anything
+    def release(self):
+        """the track is over: the instance is idle again"""
+        if self.stop_token is not None:
             self.stop_token.cancel()
             self.stop_token = None
-        else:
-            print("warning: a button won't uncheck itself automatically at track end")
-        self.on_stop()
-        self.on_stop = None
+        # the instance is free before on_stop is called: the callback may want to use it
+        on_stop, self.on_stop = self.on_stop, None
         self.is_playing = False
+        TRACER.end(self.track_span)
+        self.track_span = None
+        if on_stop is not None:
+            on_stop()
+
+
+# same as VlcInstance, but runs fakevlc.py (a headless stand-in for vlc) instead of vlc.
+# used to test or measure the instance pool without any audio.
+class FakeVlcInstance(VlcInstance):
+    fake_options = []  # extra command line options for fakevlc.py (see `fakevlc.py --help`)
+
+    def get_command(self):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fakevlc.py')
+        return [sys.executable, script] + self.fake_options, None
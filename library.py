@@ -0,0 +1,124 @@
+#!/bin/false
+
+# index of the sounds directory, saved on disk between launches.
+# listing big directories (especially on network shares) is slow: a directory is only read again
+# if its modification time changed since the last launch (which happens when files are added, removed or renamed).
+
+import os
+import os.path
+import re
+import json
+
+INDEX_VERSION = 1
+
+skip_detector = re.compile(r'(?P<core>.*?)\#'+
+                           r'(?P<seconds>[0-9]*)'+
+                           r'\.(?P<ext>[a-zA-Z0-9]*)')
+
+def parse_skip(name):
+    """returns the number of seconds to skip from a file name ending with '#25.ext' (2.5 seconds), or None"""
+    has_skip = skip_detector.fullmatch(name)
+    if has_skip and has_skip.groupdict()['seconds']:
+        # the last digit is for tenths of seconds ('#25' skips 2.5 seconds)
+        return int(has_skip.groupdict()['seconds']) / 10
+    return None
+
+def read_dir(path):
+    """lists a directory: returns its subdirectories and files (name, size and skip), in listing order"""
+    dirs = []
+    files = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                else:
+                    files.append({'name': entry.name, 'size': entry.stat().st_size,
+                                  'skip': parse_skip(entry.name)})
+            except OSError:  # broken link, or file removed in the meantime
+                print('warning: cannot read', os.path.join(path, entry.name))
+    return {'dirs': dirs, 'files': files}
+
+
+class LibraryIndex:
+    def __init__(self, root, index_file):
+        self.root = root
+        self.index_file = index_file
+        self.dirs = {}  # path relative to root ('' for root) -> {'mtime', 'dirs', 'files'}
+        self.changed = False  # if the index has to be saved
+
+    def load(self):
+        try:
+            with open(self.index_file, 'r') as file:
+                data = json.load(file)
+            if data.get('version') == INDEX_VERSION and data.get('root') == os.path.abspath(self.root):
+                self.dirs = data['dirs']
+        except (OSError, ValueError, KeyError):
+            pass  # no index (or an unusable one): everything will be read
+
+    def save(self):
+        if not self.changed:
+            return
+        data = {'version': INDEX_VERSION, 'root': os.path.abspath(self.root), 'dirs': self.dirs}
+        try:
+            with open(self.index_file+'.tmp', 'w') as file:
+                json.dump(data, file)
+            os.replace(self.index_file+'.tmp', self.index_file)
+            self.changed = False
+        except OSError as err:
+            print('warning: could not save the sounds index:', err)
+
+    def scan(self, reread=()):
+        """updates the index: reads again the directories which changed, and the ones in `reread`.
+        returns the set of the directories whose listing changed (including the added and removed ones).
+        the new index is built aside, and replaces the old one at once: it can be read from other threads meanwhile"""
+        old = self.dirs
+        dirs = {}
+        changed = set()
+        self._scan_dir('', old, dirs, changed, set(reread))
+        for reldir in old:
+            if reldir not in dirs:  # removed directory
+                changed.add(reldir)
+                self.changed = True
+        self.dirs = dirs
+        return changed
+
+    def _scan_dir(self, reldir, old, dirs, changed, reread):
+        path = os.path.join(self.root, reldir)
+        listing = old.get(reldir)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            if listing is None or listing['mtime'] != mtime or reldir in reread:
+                new_listing = read_dir(path)
+            else:
+                new_listing = None
+        except OSError:
+            if not reldir:
+                raise
+            return  # removed in the meantime: it will be pruned
+        if new_listing is not None:
+            new_listing['mtime'] = mtime
+            self.changed = True
+            if listing is None or listing['dirs'] != new_listing['dirs'] \
+                    or listing['files'] != new_listing['files']:
+                changed.add(reldir)
+            listing = new_listing
+        dirs[reldir] = listing
+        for subdir in listing['dirs']:
+            self._scan_dir(os.path.join(reldir, subdir), old, dirs, changed, reread)
+
+    def listing(self, reldir=''):
+        """{'dirs': [names], 'files': [{'name', 'size', 'skip'}]} for a directory (relative to root)"""
+        return self.dirs[reldir]
+
+    def files(self, reldirs=None):
+        """the real paths of all the files of the given directories (of the whole index if None)"""
+        dirs = self.dirs  # (the index may be replaced meanwhile: see scan)
+        for reldir in (dirs if reldirs is None else reldirs):
+            if reldir in dirs:
+                for file in dirs[reldir]['files']:
+                    yield self.path(reldir, file['name'])
+
+    def path(self, reldir, name=''):
+        """the real path of a file (or directory) of the index"""
+        return os.path.join(self.root, reldir, name)
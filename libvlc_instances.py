@@ -0,0 +1,164 @@
+#!/bin/false
+
+# in-process playback backend: every "instance" is a libvlc media player living inside the MASSS process.
+# much lighter than one `vlc -I rc` process per voice, and commands are plain function calls.
+# needs the python-vlc bindings (pip install python-vlc), and the libvlc shipped with vlc itself.
+
+import os
+import asyncio as aio
+from collections import deque
+from time import monotonic as time
+from instances import BaseInstance, START_TIMEOUT
+from tracer import TRACER, current_press
+
+try:
+    import vlc
+except ImportError:  # the rc backend doesn't need this
+    vlc = None
+
+
+_libvlc = None  # the libvlc instance shared by all media players, created on first use
+
+def get_libvlc():
+    global _libvlc
+    if vlc is None:
+        raise RuntimeError('the libvlc backend needs the python-vlc bindings (pip install python-vlc)')
+    if _libvlc is None:
+        _libvlc = vlc.Instance('--no-video-title-show')
+    return _libvlc
+
+def make_equalizer(eq_cache):
+    """converts the equalizer string used by the rc backend (10 gains in dB) into a libvlc equalizer"""
+    eq = vlc.AudioEqualizer()
+    eq.set_preamp(12.0)
+    for i, amp in enumerate(eq_cache.split()):
+        eq.set_amp_at_index(float(amp), i)
+    return eq
+
+
+# a libvlc media player, behind the same interface as instances.VlcInstance
+class LibVlcInstance(BaseInstance):
+    def __init__(self, eq_cache, vol_cache, loop):
+        BaseInstance.__init__(self, eq_cache, vol_cache, loop)
+        self.play_count = 0  # to recognize the end-of-track events of older tracks
+        self.cued = None  # (filename, skip) of the track loaded by cue()
+        self.paused = aio.Event()  # set when the cued track is paused at its start
+        # the medias of the current and previous tracks, with their event managers: python-vlc keeps the callbacks
+        # on the event manager objects, which must live as long as libvlc may call them (even late)
+        self.medias = deque(maxlen=2)
+
+        self.player = get_libvlc().media_player_new()
+        self.player.set_equalizer(make_equalizer(eq_cache))
+        self.vol()
+        self.spawn_duration = time() - self.creation_time
+        # no process to wait for: the instance is ready right away (start_task stays None)
+
+    def set_eq(self, eq_cache):
+        # applies to the track being played too
+        self.player.set_equalizer(make_equalizer(eq_cache))
+        return True
+
+    def terminate(self):
+        if self.player is not None:
+            self.player.stop()
+            self.player.release()
+            self.player = None
+        self.term_time = time()
+        self.term_attempts = 1
+
+    def is_cleanable(self, event=None):
+        return False  # no connection or process which could break
+
+    def check_termination(self):
+        return True  # release() is synchronous
+
+    def terminate_broken(self):
+        self.terminate()
+
+    def vol(self, v=None):
+        if v is not None:
+            self.vol_cache = v
+        # None is for updating libvlc only
+        # (libvlc volumes are in percents, where the rc interface uses 256 for 100%)
+        true_vol = int(self.vol_cache * 100 *self.vol_modifier)
+        self.player.audio_set_volume(true_vol)
+
+    async def play(self, filename, skip, on_stop, length=None):
+        # the end of the track is reported by libvlc: the length is not needed
+        if self.is_playing:
+            print("warning: for some reason, a track was stopped in order to start a new one. Expect an audio glitch now.")
+            self.stop()
+        self.is_playing = True
+        self.player.set_media(self.new_media(filename, skip))
+        self.cued = None
+        self.on_stop = on_stop
+        if self.player.play() == -1:
+            self.is_playing = False
+            self.on_stop = None
+            raise OSError('libvlc could not play '+filename)
+        self.add_time = time()
+        self.press = current_press.get()
+        self.track_span = TRACER.begin('track', file=os.path.basename(filename))
+        self.vol()
+
+    async def cue(self, filename, skip):
+        self.paused.clear()
+        self.player.set_media(self.new_media(filename, skip, ':start-paused'))
+        if self.player.play() == -1:
+            raise OSError('libvlc could not cue '+filename)
+        # play() returns right away: wait for the track to be opened (and paused), or resume() would come too early
+        try:
+            await aio.wait_for(self.paused.wait(), START_TIMEOUT)
+        except aio.TimeoutError:
+            raise TimeoutError('libvlc did not cue {:s}'.format(filename))
+        self.cued = (filename, skip)
+
+    async def resume(self, on_stop, length=None):
+        (filename, _), self.cued = self.cued, None
+        self.is_playing = True
+        self.on_stop = on_stop
+        self.player.set_pause(0)
+        self.add_time = time()
+        self.press = current_press.get()
+        self.track_span = TRACER.begin('track', file=os.path.basename(filename), cued=True)
+        self.vol()
+
+    def new_media(self, filename, skip, *options):
+        """a media for the next track. its end is reported with the number of the track: the late events of
+        a previous track (on this same player) are recognized as such"""
+        self.play_count += 1
+        media = get_libvlc().media_new_path(filename)
+        for option in options:
+            media.add_option(option)
+        if skip:
+            media.add_option(':start-time={:g}'.format(skip))
+        events = media.event_manager()
+        events.event_attach(vlc.EventType.MediaStateChanged, self._on_state_changed, self.play_count)
+        self.medias.append((media, events))
+        return media
+
+    def _on_state_changed(self, event, play_count):
+        # called from a libvlc thread, where libvlc itself must not be called: go back to the loop
+        if event.u.new_state in (vlc.State.Ended, vlc.State.Error):
+            self.loop.call_soon_threadsafe(self._ended, play_count)
+        elif event.u.new_state == vlc.State.Paused:
+            self.loop.call_soon_threadsafe(self._paused, play_count)
+
+    def _paused(self, play_count):
+        if play_count == self.play_count:
+            self.paused.set()
+
+    def _ended(self, play_count):
+        if self.is_playing and play_count == self.play_count:
+            TRACER.instant('track ended', self.press)
+            self.stop()
+
+    def stop(self, event=None):
+        self.player.stop()
+        # the instance is free before on_stop is called: the callback may want to use it
+        on_stop, self.on_stop = self.on_stop, None
+        self.is_playing = False
+        TRACER.end(self.track_span)
+        self.track_span = None
+        if on_stop is not None:
+            on_stop()
@@ -0,0 +1,166 @@
+#!/bin/false
+
+# track lengths (and a few other properties) of the sounds, read ahead of time by worker threads.
+# vlc reports the end of the tracks itself. the lengths are a safety net, in case that report gets lost:
+# a track whose length is known is stopped shortly after its end anyway.
+# the results are saved on disk, and are valid as long as the file keeps the same size and modification time.
+#
+# the files are read with the wave module (wav files), mutagen (most formats, if installed: pip install mutagen),
+# or ffprobe (if it is in the PATH). files none of them can read have no metadata.
+
+import os
+import json
+import wave
+import shutil
+import subprocess as sb
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import mutagen
+except ImportError:  # optional
+    mutagen = None
+
+CACHE_VERSION = 1
+FFPROBE = shutil.which('ffprobe')
+
+
+# ## probing functions: return {'length', 'codec', 'channels', 'rate'} (values can be None), or None
+def probe_wave(path):
+    try:
+        with wave.open(path, 'rb') as file:
+            return {'length': file.getnframes() / file.getframerate(), 'codec': 'pcm_s{:d}'.format(8*file.getsampwidth()),
+                    'channels': file.getnchannels(), 'rate': file.getframerate()}
+    except (wave.Error, EOFError, OSError, ZeroDivisionError):
+        return None
+
+def probe_mutagen(path):
+    try:
+        file = mutagen.File(path)
+    except Exception:  # mutagen raises its own errors for each format
+        return None
+    if file is None or getattr(file.info, 'length', None) is None:
+        return None
+    return {'length': float(file.info.length), 'codec': type(file).__name__.lower(),
+            'channels': getattr(file.info, 'channels', None), 'rate': getattr(file.info, 'sample_rate', None)}
+
+def probe_ffprobe(path):
+    try:
+        out = sb.run([FFPROBE, '-v', 'error', '-select_streams', 'a:0', '-of', 'json',
+                      '-show_entries', 'format=duration:stream=codec_name,channels,sample_rate', path],
+                     stdout=sb.PIPE, stderr=sb.DEVNULL, timeout=10).stdout
+        data = json.loads(out.decode(errors='replace'))
+        stream = (data.get('streams') or [{}])[0]
+        return {'length': float(data['format']['duration']), 'codec': stream.get('codec_name'),
+                'channels': stream.get('channels'),
+                'rate': int(stream['sample_rate']) if 'sample_rate' in stream else None}
+    except (OSError, ValueError, KeyError, TypeError, sb.TimeoutExpired):
+        return None
+
+def probe(path):
+    """reads the metadata of a sound file, or returns None if it can't"""
+    probes = [probe_wave] if path.lower().endswith('.wav') else []
+    if mutagen is not None:
+        probes.append(probe_mutagen)
+    if FFPROBE is not None:
+        probes.append(probe_ffprobe)
+    for function in probes:
+        meta = function(path)
+        if meta is not None:
+            return meta
+    return None
+
+
+class MetadataCache:
+    def __init__(self, cache_file, loop, workers=2, save_delay=5.0):
+        self.cache_file = cache_file
+        self.loop = loop
+        self.entries = {}  # path -> {'size', 'mtime', 'meta'} ('meta' is None for unreadable files)
+        self.executor = ThreadPoolExecutor(workers)
+        self.probing = set()  # paths being read
+        self.save_delay = save_delay  # the results are saved by batches
+        self.save_token = None
+        self.changed = False
+
+    def load(self):
+        try:
+            with open(self.cache_file, 'r') as file:
+                data = json.load(file)
+            if data.get('version') == CACHE_VERSION:
+                self.entries = data['entries']
+        except (OSError, ValueError, KeyError):
+            pass  # no cache (or an unusable one): everything will be read again
+
+    def save(self):
+        if self.save_token is not None:
+            self.save_token.cancel()
+            self.save_token = None
+        if not self.changed:
+            return
+        try:
+            with open(self.cache_file+'.tmp', 'w') as file:
+                json.dump({'version': CACHE_VERSION, 'entries': self.entries}, file)
+            os.replace(self.cache_file+'.tmp', self.cache_file)
+            self.changed = False
+        except OSError as err:
+            print('warning: could not save the sounds metadata:', err)
+
+    def close(self):
+        try:
+            self.executor.shutdown(wait=False, cancel_futures=True)  # don't read the whole library before quitting
+        except TypeError:  # python < 3.9
+            self.executor.shutdown(wait=False)
+        self.save()
+
+    def _valid_entry(self, path, stat):
+        entry = self.entries.get(path)
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            return entry
+        return None
+
+    def get(self, path):
+        """the metadata of a file, or None if it isn't known (yet). unknown files are read in the background"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        entry = self._valid_entry(path, stat)
+        if entry is None:
+            self._probe(path)
+            return None
+        return entry['meta']
+
+    def length(self, path):
+        """the length of a track in seconds (a float), or None if it isn't known"""
+        meta = self.get(path)
+        return None if meta is None else meta['length']
+
+    def prefetch(self, paths):
+        """reads the metadata of the files which aren't in the cache yet, in the background"""
+        for path in paths:
+            self._probe(path)
+
+    def _probe(self, path):
+        if path in self.probing:
+            return
+        self.probing.add(path)
+        future = self.loop.run_in_executor(self.executor, self._read, path)
+        future.add_done_callback(lambda f: self._probed(path, f))
+
+    def _read(self, path):
+        """(in a worker thread) returns a new cache entry for a file, or None if the cached one is still valid"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if self._valid_entry(path, stat) is not None:
+            return None
+        return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'meta': probe(path)}
+
+    def _probed(self, path, future):
+        self.probing.discard(path)
+        if future.cancelled() or future.exception() is not None or future.result() is None:
+            return
+        self.entries[path] = future.result()
+        self.changed = True
+        if self.save_token is None:
+            self.save_token = self.loop.call_later(self.save_delay, self.save)
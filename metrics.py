@@ -0,0 +1,288 @@
+#!/bin/false
+
+# health measures of the pool and of the playback: counters, gauges and histograms.
+# the modules create their metrics once (at import) in REGISTRY, and update them as things happen.
+# they are read through a small HTTP server (prometheus text format at /metrics, json at /metrics.json),
+# and can also be dumped to a json file every few seconds.
+#
+# everything here (updates, gauge functions, the server) runs in the event loop's thread, never in Tk's:
+# no locking is needed, and a scrape never waits for the UI.
+
+import os
+import json
+import math
+import asyncio as aio
+from time import time as wall_time
+
+# latency buckets, in seconds (from half a millisecond to 10 seconds)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = ('{:s}="{:s}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+               for name, value in labels)
+    return '{' + ','.join(escaped) + '}'
+
+
+# ## metrics. a metric with label names has one value per combination of label values (see labels()).
+# without label names, its methods can be called directly on it.
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.children = {}  # label values -> value holder
+        if not self.labelnames:
+            self.labels()  # shown (as 0) even before its first update
+
+    def labels(self, *values):
+        """the value holder for these label values (created on first use)"""
+        if len(values) != len(self.labelnames):
+            raise ValueError('{:s} has labels {}'.format(self.name, self.labelnames))
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.new_child()
+        return child
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        """yields (name suffix, labels as (name, value) pairs, value)"""
+        for values, child in self.children.items():
+            for suffix, extra, value in child.samples():
+                yield suffix, tuple(zip(self.labelnames, values)) + extra, value
+
+    def snapshot(self):
+        return [dict(zip(self.labelnames, values), **child.snapshot()) for values, child in self.children.items()]
+
+
+class _CounterValue:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield '_total', (), self.value
+
+    def snapshot(self):
+        return {'value': self.value}
+
+class Counter(Metric):
+    """a count of events, which only goes up"""
+    type = 'counter'
+
+    def new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class _GaugeValue:
+    def __init__(self, function=None):
+        self.value = 0
+        self.function = function
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+    def samples(self):
+        yield '', (), self.get()
+
+    def snapshot(self):
+        return {'value': self.get()}
+
+class Gauge(Metric):
+    """a value which goes up and down. if `function` is given, it is called to read the value"""
+    type = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), function=None):
+        self.function = function
+        Metric.__init__(self, name, help, labelnames)
+
+    def new_child(self):
+        return _GaugeValue(self.function)
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)  # not cumulative
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        cumulated = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulated += count
+            yield '_bucket', (('le', format_value(float(bound))),), cumulated
+        yield '_bucket', (('le', '+Inf'),), self.count
+        yield '_sum', (), self.sum
+        yield '_count', (), self.count
+
+    def snapshot(self):
+        return {'buckets': dict(zip(map(format_value, self.buckets), self.counts)),
+                'sum': self.sum, 'count': self.count}
+
+class Histogram(Metric):
+    """the distribution of measures (durations, mostly)"""
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        Metric.__init__(self, name, help, labelnames)
+
+    def new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}  # name -> Metric, in creation order
+
+    def register(self, metric):
+        """adds a metric, replacing the one with the same name"""
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=(), function=None):
+        return self.register(Gauge(name, help, labelnames, function))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def prometheus(self):
+        """all the metrics, in prometheus' text exposition format"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append('# HELP {:s} {:s}'.format(metric.name, metric.help.replace('\\', r'\\').replace('\n', r'\n')))
+            lines.append('# TYPE {:s} {:s}'.format(metric.name, metric.type))
+            for suffix, labels, value in metric.samples():
+                lines.append('{:s}{:s}{:s} {:s}'.format(metric.name, suffix, format_labels(labels), format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """all the metrics, as a dict that can be saved as json"""
+        return {'time': wall_time(),
+                'metrics': {name: {'type': metric.type, 'help': metric.help, 'values': metric.snapshot()}
+                            for name, metric in self.metrics.items()}}
+
+REGISTRY = Registry()  # where all the metrics of MASSS are
+
+
+# ## reading the metrics
+class MetricsServer:
+    """serves the metrics over HTTP: GET /metrics (prometheus) and GET /metrics.json"""
+    def __init__(self, loop, port, host='127.0.0.1', registry=REGISTRY):
+        self.loop = loop
+        self.port = port
+        self.host = host
+        self.registry = registry
+        self.server = None
+
+    async def start(self):
+        try:
+            self.server = await aio.start_server(self.handle, self.host, self.port)
+        except OSError as err:
+            print('warning: cannot serve the metrics on port {:d}: {}'.format(self.port, err))
+            return
+        print('metrics served at http://{:s}:{:d}/metrics'.format(self.host, self.server.sockets[0].getsockname()[1]))
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+    async def handle(self, reader, writer):
+        try:
+            request = await aio.wait_for(reader.readuntil(b'\r\n\r\n'), 5)
+            method, path = request.split(b'\r\n', 1)[0].decode('latin-1').split(' ')[:2]
+            path = path.split('?', 1)[0]
+            if method != 'GET':
+                status, content_type, body = '405 Method Not Allowed', 'text/plain', 'only GET is supported\n'
+            elif path == '/metrics':
+                status, content_type, body = '200 OK', 'text/plain; version=0.0.4', self.registry.prometheus()
+            elif path == '/metrics.json':
+                status, content_type, body = '200 OK', 'application/json', json.dumps(self.registry.snapshot())
+            else:
+                status, content_type, body = '404 Not Found', 'text/plain', 'try /metrics or /metrics.json\n'
+            body = body.encode()
+            writer.write('HTTP/1.0 {:s}\r\nContent-Type: {:s}; charset=utf-8\r\nContent-Length: {:d}\r\n'
+                         'Connection: close\r\n\r\n'.format(status, content_type, len(body)).encode() + body)
+            await writer.drain()
+        except (OSError, ValueError, aio.IncompleteReadError, aio.LimitOverrunError, aio.TimeoutError):
+            pass  # a broken request: nothing to answer
+        finally:
+            writer.close()
+
+
+def write_json(path, data):
+    with open(path+'.tmp', 'w') as file:
+        json.dump(data, file, indent=1)
+    os.replace(path+'.tmp', path)
+
+class JsonDumper:
+    """writes the metrics to a json file every `interval` seconds (and a last time when closed)"""
+    def __init__(self, loop, path, interval=10.0, registry=REGISTRY):
+        self.loop = loop
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self.handle = None
+        self.task = None
+
+    def start(self):
+        self.handle = self.loop.call_later(self.interval, self.dump)
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+            self.save(self.registry.snapshot())
+
+    def dump(self):
+        # the snapshot is taken here (in the event loop's thread), the file is written by a worker thread
+        data = self.registry.snapshot()
+        if self.task is None or self.task.done():
+            self.task = self.loop.run_in_executor(None, self.save, data)
+        self.handle = self.loop.call_later(self.interval, self.dump)
+
+    def save(self, data):
+        try:
+            write_json(self.path, data)
+        except OSError as err:
+            print('warning: could not save the metrics:', err)
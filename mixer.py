@@ -0,0 +1,339 @@
+#!/bin/false
+
+# in-process software mixer, for short sounds (stingers, sound effects...): no vlc voice is needed to play them.
+# the sounds are decoded once, and kept in memory. all the playing sounds are mixed by blocks, in a dedicated thread,
+# with numpy: per-sound gain, equalizer (the same 10 bands as vlc), master volume.
+# the mix goes to the sound card (needs sounddevice: pip install sounddevice), to a wav file, or nowhere (for tests).
+#
+# needs numpy (pip install numpy). the equalizer uses scipy if it is installed, and an FFT convolution otherwise.
+# wav files are decoded by the wave module, the other formats by ffmpeg (if it is in the PATH).
+
+import os
+import wave
+import shutil
+import threading
+import subprocess as sb
+from collections import OrderedDict
+from time import monotonic as time, sleep
+
+try:
+    import numpy as np
+except ImportError:  # the mixer is optional
+    np = None
+try:
+    import sounddevice
+except ImportError:
+    sounddevice = None
+try:
+    from scipy import signal
+except ImportError:
+    signal = None
+
+RATE = 48000
+CHANNELS = 2
+BLOCK = 512  # frames mixed at once (about 10 ms)
+EQ_BANDS = [60, 170, 310, 600, 1000, 3000, 6000, 12000, 14000, 16000]  # vlc's equalizer bands (Hz)
+EQ_Q = 1.4
+EQ_PREAMP = 12.0  # dB, as vlc's --equalizer-preamp (and libvlc's set_preamp) in the other backends
+FIR_LENGTH = 4096  # length of the equalizer's impulse response, without scipy
+FFMPEG = shutil.which('ffmpeg')
+
+
+def check_numpy():
+    if np is None:
+        raise RuntimeError('the mixer needs numpy (pip install numpy)')
+
+
+# ## decoding
+def to_stereo(pcm):
+    """(frames, channels) -> (frames, 2)"""
+    if pcm.shape[1] == 1:
+        return np.repeat(pcm, 2, axis=1)
+    return pcm[:, :2]
+
+def resample(pcm, rate_in, rate_out):
+    """linear interpolation: good enough for sound effects"""
+    if rate_in == rate_out:
+        return pcm
+    frames = int(len(pcm) * rate_out / rate_in)
+    x = np.arange(frames) * (rate_in / rate_out)
+    return np.stack([np.interp(x, np.arange(len(pcm)), pcm[:, c]) for c in range(pcm.shape[1])], axis=1)
+
+def decode_wave(path):
+    with wave.open(path, 'rb') as file:
+        width = file.getsampwidth()
+        channels = file.getnchannels()
+        rate = file.getframerate()
+        data = file.readframes(file.getnframes())
+    if width == 1:  # unsigned 8 bits
+        pcm = (np.frombuffer(data, np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        pcm = np.frombuffer(data, '<i2').astype(np.float32) / 2**15
+    elif width == 4:
+        pcm = np.frombuffer(data, '<i4').astype(np.float32) / 2**31
+    else:
+        return None
+    return resample(pcm.reshape(-1, channels), rate, RATE)
+
+def decode_ffmpeg(path):
+    out = sb.run([FFMPEG, '-v', 'error', '-i', path, '-f', 'f32le', '-ac', str(CHANNELS), '-ar', str(RATE), '-'],
+                 stdout=sb.PIPE, stderr=sb.DEVNULL, timeout=30)
+    if out.returncode != 0:
+        return None
+    return np.frombuffer(out.stdout, '<f4').reshape(-1, CHANNELS)
+
+def decode(path):
+    """decodes a sound file: returns a (frames, 2) float32 array at RATE, or None if it can't"""
+    try:
+        pcm = None
+        if path.lower().endswith('.wav'):
+            pcm = decode_wave(path)
+        if pcm is None and FFMPEG is not None:
+            pcm = decode_ffmpeg(path)
+    except (wave.Error, EOFError, OSError, ValueError, sb.TimeoutExpired):
+        return None
+    if pcm is None:
+        return None
+    return np.ascontiguousarray(to_stereo(pcm), dtype=np.float32)
+
+
+# ## equalizer
+def peaking_biquad(freq, gain_db, q=EQ_Q, rate=RATE):
+    """peaking filter (from the audio EQ cookbook), as a second-order section [b0, b1, b2, 1, a1, a2]"""
+    a = 10 ** (gain_db / 40)
+    w0 = 2 * np.pi * freq / rate
+    alpha = np.sin(w0) / (2 * q)
+    b = np.array([1 + alpha*a, -2*np.cos(w0), 1 - alpha*a])
+    den = np.array([1 + alpha/a, -2*np.cos(w0), 1 - alpha/a])
+    return np.concatenate([b / den[0], den / den[0]])
+
+class Equalizer:
+    """the 10 bands of the equalizer string (gains in dB, as for vlc) as a cascade of biquads, after the preamp.
+    filters the mix block by block, keeping its state between blocks"""
+    def __init__(self, eq_cache):
+        self.preamp = 10 ** (EQ_PREAMP / 20)
+        gains = [float(g) for g in eq_cache.split()]
+        self.sos = np.array([peaking_biquad(f, g) for f, g in zip(EQ_BANDS, gains) if g != 0])
+        self.is_flat = len(self.sos) == 0
+        if self.is_flat:
+            return
+        if signal is not None:
+            self.zi = np.zeros((len(self.sos), 2, CHANNELS))
+        else:
+            # no scipy: convolve with the (truncated) impulse response of the cascade, in the frequency domain
+            self.nfft = 1 << (BLOCK + FIR_LENGTH - 1).bit_length()
+            z = np.exp(-1j * np.linspace(0, np.pi, FIR_LENGTH//2 + 1))
+            response = np.ones_like(z)
+            for b0, b1, b2, _, a1, a2 in self.sos:
+                response *= (b0 + b1*z + b2*z**2) / (1 + a1*z + a2*z**2)
+            fir = np.fft.irfft(response, FIR_LENGTH)
+            fir *= np.hanning(2*FIR_LENGTH)[FIR_LENGTH:]  # fade out the truncated tail
+            self.fir = np.fft.rfft(fir, self.nfft)[:, None]
+            self.tail = np.zeros((FIR_LENGTH - 1, CHANNELS))
+
+    def process(self, block):
+        block = block * self.preamp
+        if self.is_flat:
+            return block
+        if signal is not None:
+            block, self.zi = signal.sosfilt(self.sos, block, axis=0, zi=self.zi)
+            return block
+        out = np.fft.irfft(np.fft.rfft(block, self.nfft, axis=0) * self.fir, self.nfft, axis=0)
+        out = out[:len(block) + FIR_LENGTH - 1]
+        out[:FIR_LENGTH - 1] += self.tail  # overlap-add
+        self.tail = out[len(block):].copy()
+        return out[:len(block)]
+
+
+# ## sinks: where the mix goes. write() blocks until the sink can take more (or not at all, if not `is_paced`)
+class AudioSink:
+    is_paced = True  # the sound card sets the pace
+
+    def __init__(self):
+        if sounddevice is None:
+            raise RuntimeError('playing through the mixer needs sounddevice (pip install sounddevice)')
+        self.stream = sounddevice.OutputStream(samplerate=RATE, channels=CHANNELS, dtype='float32', blocksize=BLOCK)
+        self.stream.start()
+
+    def write(self, block):
+        self.stream.write(block)
+
+    def close(self):
+        self.stream.stop()
+        self.stream.close()
+
+class NullSink:
+    is_paced = False
+
+    def write(self, block):
+        pass
+
+    def close(self):
+        pass
+
+class WaveSink(NullSink):
+    """writes the mix to a wav file (16 bits)"""
+    def __init__(self, path):
+        self.file = wave.open(path, 'wb')
+        self.file.setnchannels(CHANNELS)
+        self.file.setsampwidth(2)
+        self.file.setframerate(RATE)
+
+    def write(self, block):
+        self.file.writeframes((block * (2**15 - 1)).astype('<i2').tobytes())
+
+    def close(self):
+        self.file.close()
+
+def make_sink(name):
+    """'audio' for the sound card, 'null' for nowhere, anything else is a wav file to write"""
+    if name == 'audio':
+        return AudioSink()
+    if name == 'null':
+        return NullSink()
+    return WaveSink(name)
+
+
+# one sound played by the mixer. has the same playback methods as the instances (instances.BaseInstance),
+# so that VlcInterface can control it the same way
+class MixerVoice:
+    def __init__(self, mixer, pcm, position, on_stop):
+        self.mixer = mixer
+        self.pcm = pcm
+        self.position = position  # in frames. (only used by the mixer thread)
+        self.vol_modifier = 1.0
+        self.on_stop = on_stop
+        self.is_playing = True
+
+    def vol(self, v=None):
+        pass  # vol_modifier is read by the mixer thread at each block. the master volume is the mixer's
+
+    def stop(self, event=None):
+        self.mixer.remove(self)
+        on_stop, self.on_stop = self.on_stop, None
+        self.is_playing = False
+        if on_stop is not None:
+            on_stop()
+
+
+class Mixer:
+    def __init__(self, sink, loop, max_size=4*2**20, max_length=10.0, cache_size=256*2**20):
+        """plays the files smaller than `max_size` bytes and shorter than `max_length` seconds.
+        the length has to be known: a long file would be decoded when its button is pressed.
+        at most `cache_size` bytes of decoded sound are kept in memory"""
+        check_numpy()
+        self.sink = sink
+        self.loop = loop
+        self.max_size = max_size
+        self.max_length = max_length
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # path -> (size, mtime, pcm), least recently used first
+        self.cache_bytes = 0
+        self.unplayable = set()  # paths which could not be decoded
+
+        self.master = 0.5
+        self.equalizer = Equalizer(' ' + 10*'0 ')
+        self.voices = []
+        self.lock = threading.Lock()  # for self.voices
+        self.is_running = True
+        self.thread = threading.Thread(target=self.run, name='mixer', daemon=True)
+        self.thread.start()
+
+    # ## controls (from the event loop's thread)
+    def accepts(self, path, length=None):
+        """whether a file should be played by the mixer rather than by vlc"""
+        if path in self.unplayable:
+            return False
+        if length is None or length > self.max_length:
+            return False
+        try:
+            return os.stat(path).st_size <= self.max_size
+        except OSError:
+            return False
+
+    def set_eq(self, eq_cache):
+        self.equalizer = Equalizer(eq_cache)  # (the mixer thread picks it up at the next block)
+
+    def vol(self, v):
+        self.master = v
+
+    async def play(self, path, skip, on_stop):
+        """starts playing a file. returns its MixerVoice, or None if the file can't be decoded"""
+        pcm = await self.load(path)
+        if pcm is None:
+            return None
+        voice = MixerVoice(self, pcm, int((skip or 0) * RATE), on_stop)
+        with self.lock:
+            self.voices.append(voice)
+        return voice
+
+    def remove(self, voice):
+        with self.lock:
+            if voice in self.voices:
+                self.voices.remove(voice)
+
+    async def load(self, path):
+        """the decoded file, from the cache if it is still valid"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        cached = self.cache.get(path)
+        if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            self.cache.move_to_end(path)
+            return cached[2]
+        pcm = await self.loop.run_in_executor(None, decode, path)
+        if pcm is None:
+            self.unplayable.add(path)
+            return None
+        if path in self.cache:
+            self.cache_bytes -= self.cache.pop(path)[2].nbytes
+        self.cache[path] = (stat.st_size, stat.st_mtime_ns, pcm)
+        self.cache_bytes += pcm.nbytes
+        while self.cache_bytes > self.cache_size and len(self.cache) > 1:
+            self.cache_bytes -= self.cache.popitem(last=False)[1][2].nbytes
+        return pcm
+
+    def close(self):
+        self.is_running = False
+        self.thread.join(1)
+        self.sink.close()
+
+    # ## mixing (in the mixer thread)
+    def render(self):
+        """mixes the next block of all the playing voices"""
+        out = np.zeros((BLOCK, CHANNELS), dtype=np.float32)
+        ended = []
+        with self.lock:
+            voices = list(self.voices)
+        for voice in voices:
+            chunk = voice.pcm[voice.position:voice.position+BLOCK]
+            out[:len(chunk)] += chunk * voice.vol_modifier
+            voice.position += BLOCK
+            if voice.position >= len(voice.pcm):
+                ended.append(voice)
+        for voice in ended:
+            self.remove(voice)
+            try:
+                self.loop.call_soon_threadsafe(self._ended, voice)
+            except RuntimeError:  # the loop is closed: MASSS is quitting
+                pass
+        out = self.equalizer.process(out) * self.master
+        return np.clip(out, -1, 1).astype(np.float32)
+
+    def _ended(self, voice):
+        if voice.is_playing:
+            voice.stop()
+
+    def run(self):
+        next_time = time()
+        while self.is_running:
+            block = self.render()
+            self.sink.write(block)
+            if not self.sink.is_paced:  # keep real time
+                next_time += BLOCK / RATE
+                delay = next_time - time()
+                if delay > 0:
+                    sleep(delay)
+                else:
+                    next_time = time()  # late: don't try to catch up
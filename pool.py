@@ -0,0 +1,119 @@
+#!/bin/false
+
+# the started instances of VlcInterface, and the voices they play.
+# every operation used when a button is pressed or a track stops takes constant time:
+# the idle instances are kept in their own sets, and the instances in numbered slots.
+#
+# a voice (one track played by one instance) is known by a Handle: its slot, and the generation of the slot.
+# the generation changes each time the instance of the slot starts or stops playing, so the handle of a voice
+# which is over is recognized as stale (and rejected), even if its instance plays another track now.
+
+from collections import namedtuple
+
+Handle = namedtuple('Handle', ['slot', 'generation'])
+
+
+class InstancePool:
+    def __init__(self):
+        self.slots = []  # instance or None
+        self.generations = []  # generation of each slot
+        self.free_slots = []  # numbers of the empty slots
+        # idle instances. dicts are used as ordered sets: constant time insertion and removal
+        self.idle_clean = {}  # those with the current equalizer
+        self.idle_dirty = {}  # those with an old one
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        """all the instances (idle or playing)"""
+        return (inst for inst in self.slots if inst is not None)
+
+    def __contains__(self, inst):
+        return inst.slot is not None and inst.slot < len(self.slots) and self.slots[inst.slot] is inst
+
+    # ## adding and removing instances
+    def add(self, inst):
+        """adds a started (and idle) instance"""
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.slots[slot] = inst
+        else:
+            slot = len(self.slots)
+            self.slots.append(inst)
+            self.generations.append(0)
+        inst.slot = slot
+        self.count += 1
+        self._set_idle(inst)
+
+    def remove(self, inst):
+        """removes an instance (idle or playing). its voice's handle becomes stale"""
+        if inst not in self:
+            return
+        self._unset_idle(inst)
+        self.slots[inst.slot] = None
+        self.generations[inst.slot] += 1
+        self.free_slots.append(inst.slot)
+        inst.slot = None
+        self.count -= 1
+
+    def pop_idle(self):
+        """removes an idle instance (a dirty one first) and returns it, or None if there is none"""
+        for idle in (self.idle_dirty, self.idle_clean):
+            if idle:
+                inst = next(iter(idle))
+                self.remove(inst)
+                return inst
+        return None
+
+    # ## voices
+    def acquire(self):
+        """takes an idle instance (one with the current equalizer if possible) to play a track.
+        returns the handle of the new voice, or None if no instance is idle"""
+        for idle in (self.idle_clean, self.idle_dirty):
+            if idle:
+                inst, _ = idle.popitem()  # the last one to become idle: the warmest
+                self.generations[inst.slot] += 1
+                return Handle(inst.slot, self.generations[inst.slot])
+        return None
+
+    def release(self, inst):
+        """the voice of an instance is over: the instance is idle again"""
+        if inst not in self:
+            return  # removed meanwhile (broken, or being terminated)
+        self.generations[inst.slot] += 1
+        self._set_idle(inst)
+
+    def get(self, handle):
+        """the instance playing the voice of `handle`, or None if that voice is over"""
+        if not isinstance(handle, Handle) or not 0 <= handle.slot < len(self.slots) \
+                or self.generations[handle.slot] != handle.generation:
+            return None
+        return self.slots[handle.slot]
+
+    # ## idle instances
+    def count_idle(self, clean_only=False):
+        if clean_only:
+            return len(self.idle_clean)
+        return len(self.idle_clean) + len(self.idle_dirty)
+
+    def count_idle_dirty(self):
+        return len(self.idle_dirty)
+
+    def first_idle_dirty(self):
+        """an idle dirty instance (still in the pool), or None"""
+        return next(iter(self.idle_dirty), None)
+
+    def mark_dirty(self, inst):
+        """to call after setting inst.is_dirty"""
+        if inst in self.idle_clean:
+            del self.idle_clean[inst]
+            self.idle_dirty[inst] = None
+
+    def _set_idle(self, inst):
+        (self.idle_dirty if inst.is_dirty else self.idle_clean)[inst] = None
+
+    def _unset_idle(self, inst):
+        self.idle_clean.pop(inst, None)
+        self.idle_dirty.pop(inst, None)
@@ -0,0 +1,165 @@
+#!/bin/false
+
+# client side of the vlc rc interface protocol.
+# vlc answers every command with zero or more lines, followed by a prompt ('> ').
+# the answers come in the order of the commands, so each one is matched to its command by counting prompts.
+# status changes ("status change: ( ... )") can be printed at any time: they are not part of any answer.
+#
+# commands are never written directly: they go through a queue, emptied by a writer task.
+# this way, sending a command never blocks (even if vlc is stalled), and commands can't interleave.
+
+import asyncio as aio
+from collections import deque
+from time import monotonic as time
+from metrics import REGISTRY
+from tracer import TRACER
+
+PROMPT = b'> '
+STATUS_CHANGE = 'status change:'
+QUEUE_SIZE = 64  # commands waiting to be written. a vlc which lets this fill up is considered broken
+
+_CLOSE = object()  # queue marker: close the connection once everything before it is written
+
+ROUNDTRIP = REGISTRY.histogram('masss_rc_command_seconds', 'time from sending an rc command to its answer',
+                               ['command'])
+
+
+class RcClient:
+    def __init__(self, reader, writer, loop, on_status=None, on_fail=None):
+        """`reader` and `writer` are the streams of a connection to vlc.
+        `on_status(line)` is called for each status change line, `on_fail(error)` once the connection is broken"""
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+        self.on_status = on_status
+        self.on_fail = on_fail
+        self.error = None  # set once the connection is broken
+        self.buffer = b''
+        self.lines = []  # lines of the answer being received
+        self.queue = aio.Queue(QUEUE_SIZE)  # (command, future, on_written) waiting to be written
+        self.pending = deque()  # futures for the answers of the written commands, in order
+        # vlc greets us with a message and a first prompt: it is the first answer to wait for
+        self.greeting = self._new_future()
+        self.pending.append(self.greeting)
+        self.reader_task = self.loop.create_task(self.read())
+        self.writer_task = self.loop.create_task(self.write())
+
+    async def wait_greeting(self, timeout=2):
+        """waits for vlc's greeting. if it doesn't come, stop waiting for it"""
+        try:
+            await aio.wait_for(aio.shield(self.greeting), timeout)
+        except aio.TimeoutError:
+            print('warning: vlc did not greet us.')
+            if self.greeting in self.pending:
+                self.pending.remove(self.greeting)
+
+    def _new_future(self):
+        future = self.loop.create_future()
+        # nobody has to await the answers: don't complain about unretrieved exceptions
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        return future
+
+    def send(self, command, on_written=None):
+        """queues a command, without blocking. returns a future for its answer (a list of lines).
+        `on_written()` is called once the command is written to the socket"""
+        if self.error is not None:
+            raise self.error
+        future = self._new_future()
+        try:
+            self.queue.put_nowait((command, future, on_written))
+        except aio.QueueFull:
+            self.fail(BlockingIOError('vlc does not read its commands anymore'))
+            raise self.error
+        sent = time()
+        verb = command.split(' ', 1)[0]
+        roundtrip = ROUNDTRIP.labels(verb)
+        span = TRACER.begin('rc ' + verb)
+        future.add_done_callback(lambda f: f.cancelled() or f.exception() or roundtrip.observe(time() - sent))
+        future.add_done_callback(lambda f: TRACER.end(span))
+        return future
+
+    async def write(self):
+        try:
+            while True:
+                item = await self.queue.get()
+                # write every queued command at once: vlc answers them in order anyway
+                while True:
+                    if item is _CLOSE:
+                        await self.writer.drain()
+                        self.abort()
+                        return
+                    command, future, on_written = item
+                    self.writer.write((command+'\n').encode())
+                    self.pending.append(future)
+                    if on_written is not None:
+                        on_written()
+                    if self.queue.empty():
+                        break
+                    item = self.queue.get_nowait()
+                await self.writer.drain()  # wait here if vlc doesn't read fast enough
+        except OSError as err:
+            self.fail(err)
+
+    async def read(self):
+        try:
+            while True:
+                data = await self.reader.read(4096)
+                if not data:
+                    raise ConnectionResetError('vlc closed the connection')
+                self.buffer += data
+                self.parse()
+        except OSError as err:
+            self.fail(err)
+
+    def parse(self):
+        """splits the received data into answers and status changes"""
+        while self.buffer:
+            if self.buffer.startswith(PROMPT):  # end of an answer
+                self.buffer = self.buffer[len(PROMPT):]
+                lines, self.lines = self.lines, []
+                if self.pending:
+                    future = self.pending.popleft()
+                    if not future.done():
+                        future.set_result(lines)
+                elif lines:
+                    print('vlc:', '\n     '.join(lines))  # nobody asked for this
+                continue
+            end = self.buffer.find(b'\n')
+            if end == -1:
+                break  # incomplete line (or prompt)
+            line = self.buffer[:end].decode(errors='replace').rstrip('\r')
+            self.buffer = self.buffer[end+1:]
+            if line.startswith(STATUS_CHANGE):
+                if self.on_status is not None:
+                    self.on_status(line[len(STATUS_CHANGE):].strip())
+            else:
+                self.lines.append(line)
+
+    def fail(self, err):
+        is_new = self.error is None
+        self.error = err
+        while self.pending:
+            future = self.pending.popleft()
+            if not future.done():
+                future.set_exception(err)
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not _CLOSE and not item[1].done():
+                item[1].set_exception(err)
+        if is_new and self.on_fail is not None:
+            self.on_fail(err)
+
+    def close(self):
+        """closes the connection once the queued commands are written"""
+        try:
+            self.queue.put_nowait(_CLOSE)
+        except aio.QueueFull:
+            self.abort()
+
+    def abort(self):
+        """closes the connection right now"""
+        if self.error is None:
+            self.fail(ConnectionAbortedError('connection to vlc closed'))
+        self.reader_task.cancel()
+        self.writer_task.cancel()
+        self.writer.close()
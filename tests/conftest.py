@@ -0,0 +1,8 @@
+#!/bin/false
+
+# the modules of MASSS are at the root of the repository (not in a package): the tests import them from there
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
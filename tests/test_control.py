@@ -0,0 +1,164 @@
+#!/bin/false
+
+# the control socket's protocol, with a VlcInterface playing through fakevlc.py processes
+
+import os
+import json
+import wave
+import shutil
+import tempfile
+import unittest
+import collections
+import asyncio as aio
+from MASSS import VlcInterface
+from instances import FakeVlcInstance
+from library import LibraryIndex
+from control import Controller, ControlServer
+
+
+class ShortFakeVlc(FakeVlcInstance):
+    fake_options = ['--fake-length', '1']  # seconds played by fakevlc
+
+
+def make_silence(path, duration=0.1):
+    with wave.open(path, 'wb') as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(8000)
+        file.writeframes(b'\0\0' * int(8000*duration))
+
+
+class Client:
+    """a connection to the control socket. the events received while waiting for an answer are kept for later"""
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.events = collections.deque()
+
+    async def receive(self):
+        return json.loads((await self.reader.readline()).decode())
+
+    async def request(self, request):
+        self.writer.write(json.dumps(request).encode() + b'\n')
+        while True:
+            message = await self.receive()
+            if 'event' not in message:
+                return message
+            self.events.append(message)
+
+    async def event(self):
+        if self.events:
+            return self.events.popleft()
+        message = await self.receive()
+        assert 'event' in message, message
+        return message
+
+
+class TestControl(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='masss-test-')
+        self.root = os.path.join(self.tmp, 'sounds')
+        os.makedirs(os.path.join(self.root, 'fx'))
+        make_silence(os.path.join(self.root, 'fx', 'kick.wav'))
+        make_silence(os.path.join(self.tmp, 'secret.wav'))  # outside of the sounds directory
+        library = LibraryIndex(self.root, os.path.join(self.tmp, 'index.json'))
+        library.scan()
+
+        self.loop = aio.new_event_loop()
+        aio.set_event_loop(self.loop)
+        self.inter = VlcInterface(1, 2, 4, ShortFakeVlc, eq_debounce=0)
+        self.controller = Controller(self.inter, library)
+        self.server = ControlServer(self.controller, 'tcp:127.0.0.1:0')
+        self.run_until(self.server.start())
+        self.port = self.server.server.sockets[0].getsockname()[1]
+        self.inter.add_task(self.inter.clean__refill())
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.writer.close()
+        self.server.close()
+        self.inter.startFinalization()
+        self.run_until(self.inter.termination_task)
+        self.loop.close()
+        aio.set_event_loop(None)
+        shutil.rmtree(self.tmp)
+
+    def run_until(self, coroutine, timeout=20):
+        return self.loop.run_until_complete(aio.wait_for(coroutine, timeout))
+
+    async def connect(self):
+        client = Client(*await aio.open_connection('127.0.0.1', self.port))
+        self.clients.append(client)
+        return client
+
+    def test_ping_and_errors(self):
+        async def scenario():
+            client = await self.connect()
+            self.assertEqual(await client.request({'id': 1, 'cmd': 'ping'}), {'id': 1, 'ok': True})
+            answer = await client.request({'id': 2, 'cmd': 'nope'})
+            self.assertEqual(answer, {'id': 2, 'ok': False, 'error': 'unknown command: nope'})
+            answer = await client.request({'id': 3, 'cmd': 'eq', 'bands': [1, 2]})
+            self.assertEqual(answer, {'id': 3, 'ok': False, 'error': 'the equalizer has 10 bands'})
+            answer = await client.request({'id': 4, 'cmd': 'stop'})  # no voice
+            self.assertEqual((answer['id'], answer['ok']), (4, False))
+            client.writer.write(b'[1, 2]\n')
+            answer = await client.receive()
+            self.assertFalse(answer['ok'])
+            self.assertTrue(answer['error'].startswith('bad request'))
+            # the connection still works
+            self.assertEqual(await client.request({'id': 5, 'cmd': 'ping'}), {'id': 5, 'ok': True})
+        self.run_until(scenario())
+
+    def test_paths_outside_the_sounds(self):
+        async def scenario():
+            client = await self.connect()
+            paths = ['../secret.wav', 'fx/missing.wav', 'fx', os.path.join(self.tmp, 'secret.wav'), 5]
+            for id, path in enumerate(paths):
+                answer = await client.request({'id': id, 'cmd': 'play', 'path': path})
+                self.assertEqual((answer['id'], answer['ok']), (id, False), path)
+            self.assertEqual(self.controller.voices, {})
+        self.run_until(scenario())
+
+    def test_play_and_stop(self):
+        async def scenario():
+            client = await self.connect()
+            await client.request({'id': 1, 'cmd': 'subscribe'})
+            answer = await client.request({'id': 2, 'cmd': 'play', 'path': 'fx/kick.wav'})
+            self.assertTrue(answer['ok'])
+            voice = answer['voice']
+            self.assertIsInstance(voice, int)
+            self.assertEqual(await client.event(), {'event': 'started', 'voice': voice, 'path': 'fx/kick.wav'})
+
+            status = await client.request({'id': 3, 'cmd': 'status'})
+            self.assertEqual(status['voices'], [{'voice': voice, 'path': 'fx/kick.wav'}])
+            self.assertGreaterEqual(status['pool']['instances'], 1)
+
+            self.assertEqual(await client.request({'id': 4, 'cmd': 'stop', 'voice': voice}), {'id': 4, 'ok': True})
+            self.assertEqual(await client.event(), {'event': 'stopped', 'voice': voice, 'path': 'fx/kick.wav'})
+            self.assertEqual((await client.request({'id': 5, 'cmd': 'status'}))['voices'], [])
+        self.run_until(scenario())
+
+    def test_track_ends(self):
+        async def scenario():
+            client = await self.connect()
+            await client.request({'id': 1, 'cmd': 'subscribe'})
+            voice = (await client.request({'id': 2, 'cmd': 'play', 'path': 'fx/kick.wav'}))['voice']
+            self.assertEqual(await client.event(), {'event': 'started', 'voice': voice, 'path': 'fx/kick.wav'})
+            self.assertEqual(await client.event(), {'event': 'stopped', 'voice': voice, 'path': 'fx/kick.wav'})
+        self.run_until(scenario())
+
+    def test_events_to_subscribers_only(self):
+        async def scenario():
+            subscriber = await self.connect()
+            other = await self.connect()
+            await subscriber.request({'id': 1, 'cmd': 'subscribe'})
+            self.assertEqual(await other.request({'id': 1, 'cmd': 'vol', 'value': 0.8}), {'id': 1, 'ok': True})
+            self.assertEqual(await subscriber.event(), {'event': 'vol', 'value': 0.8})
+            self.assertEqual(await other.request({'id': 2, 'cmd': 'ping'}), {'id': 2, 'ok': True})
+            self.assertFalse(other.events)
+        self.run_until(scenario())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/bin/false
+
+# LibraryIndex: scanning the sounds directory, and the saved index
+
+import os
+import shutil
+import tempfile
+import unittest
+from library import LibraryIndex, parse_skip
+
+
+def write(path, data=b'x'):
+    with open(path, 'wb') as file:
+        file.write(data)
+
+def touch(path):
+    """moves the modification time of a directory forward: its changes may happen within the clock's resolution"""
+    mtime = os.stat(path).st_mtime_ns + 10**9
+    os.utime(path, ns=(mtime, mtime))
+
+
+class TestParseSkip(unittest.TestCase):
+    def test_parse_skip(self):
+        self.assertEqual(parse_skip('intro#25.wav'), 2.5)
+        self.assertEqual(parse_skip('a#b#0.mp3'), 0)
+        self.assertIsNone(parse_skip('intro.wav'))
+        self.assertIsNone(parse_skip('intro#.wav'))
+        self.assertIsNone(parse_skip('intro#25'))
+
+
+class TestScan(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='masss-test-')
+        self.root = os.path.join(self.tmp, 'sounds')
+        os.makedirs(os.path.join(self.root, 'fx'))
+        write(os.path.join(self.root, 'a.wav'), b'abc')
+        write(os.path.join(self.root, 'fx', 'intro#25.wav'))
+        self.index_file = os.path.join(self.tmp, 'index.json')
+        self.library = LibraryIndex(self.root, self.index_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_first_scan(self):
+        self.assertEqual(self.library.scan(), {'', 'fx'})
+        self.assertTrue(self.library.changed)
+        self.assertEqual(self.library.listing()['dirs'], ['fx'])
+        self.assertEqual(self.library.listing()['files'], [{'name': 'a.wav', 'size': 3, 'skip': None}])
+        self.assertEqual(self.library.listing('fx')['files'], [{'name': 'intro#25.wav', 'size': 1, 'skip': 2.5}])
+        self.assertEqual(sorted(self.library.files()),
+                         sorted([os.path.join(self.root, '', 'a.wav'), os.path.join(self.root, 'fx', 'intro#25.wav')]))
+        self.assertEqual(list(self.library.files(['fx', 'nowhere'])), [os.path.join(self.root, 'fx', 'intro#25.wav')])
+
+    def test_nothing_changed(self):
+        self.library.scan()
+        self.library.changed = False
+        self.assertEqual(self.library.scan(), set())
+        self.assertFalse(self.library.changed)
+
+    def test_added_file(self):
+        self.library.scan()
+        write(os.path.join(self.root, 'fx', 'b.wav'))
+        touch(os.path.join(self.root, 'fx'))
+        self.assertEqual(self.library.scan(), {'fx'})
+        self.assertEqual(sorted(file['name'] for file in self.library.listing('fx')['files']), ['b.wav', 'intro#25.wav'])
+
+    def test_added_and_removed_dirs(self):
+        self.library.scan()
+        old = self.library.dirs
+        shutil.rmtree(os.path.join(self.root, 'fx'))
+        os.makedirs(os.path.join(self.root, 'new', 'deep'))
+        touch(os.path.join(self.root))
+        self.assertEqual(self.library.scan(), {'', 'fx', 'new', os.path.join('new', 'deep')})
+        self.assertEqual(sorted(self.library.dirs), ['', 'new', os.path.join('new', 'deep')])
+        self.assertIn('fx', old)  # the old index was replaced, not changed: a reader may still be using it
+
+    def test_reread(self):
+        self.library.scan()
+        # a change which keeps the modification time (a file written over, on some network shares)
+        fx = os.path.join(self.root, 'fx')
+        mtime = os.stat(fx).st_mtime_ns
+        write(os.path.join(fx, 'b.wav'))
+        os.utime(fx, ns=(mtime, mtime))
+        self.assertEqual(self.library.scan(), set())
+        self.assertEqual(self.library.scan(reread=['fx']), {'fx'})
+
+    def test_save_and_load(self):
+        self.library.scan()
+        self.library.save()
+        self.assertFalse(self.library.changed)
+        loaded = LibraryIndex(self.root, self.index_file)
+        loaded.load()
+        self.assertEqual(loaded.dirs, self.library.dirs)
+        self.assertEqual(loaded.scan(), set())
+        # the index of another directory is not used
+        other = LibraryIndex(os.path.join(self.root, 'fx'), self.index_file)
+        other.load()
+        self.assertEqual(other.dirs, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+#!/bin/false
+
+# the metrics, and their prometheus text format
+
+import unittest
+from metrics import Registry, format_value
+
+
+class TestFormat(unittest.TestCase):
+    def test_format_value(self):
+        self.assertEqual(format_value(3), '3')
+        self.assertEqual(format_value(3.0), '3')
+        self.assertEqual(format_value(0.25), '0.25')
+        self.assertEqual(format_value(float('inf')), '+Inf')
+
+    def test_counter(self):
+        registry = Registry()
+        counter = registry.counter('masss_things', 'things done')
+        counter.inc()
+        counter.inc(2)
+        self.assertEqual(registry.prometheus(),
+                         '# HELP masss_things things done\n'
+                         '# TYPE masss_things counter\n'
+                         'masss_things_total 3\n')
+
+    def test_labels(self):
+        registry = Registry()
+        counter = registry.counter('masss_presses', 'presses', ['outcome'])
+        self.assertEqual(registry.prometheus(), '# HELP masss_presses presses\n# TYPE masss_presses counter\n')
+        counter.labels('played').inc()
+        counter.labels('say "hi"\\\n').inc(2)
+        self.assertEqual(registry.prometheus().splitlines()[2:],
+                         ['masss_presses_total{outcome="played"} 1',
+                          'masss_presses_total{outcome="say \\"hi\\"\\\\\\n"} 2'])
+        with self.assertRaises(ValueError):
+            counter.labels()
+
+    def test_gauge(self):
+        registry = Registry()
+        gauge = registry.gauge('masss_level', 'a level')
+        gauge.set(0.5)
+        values = iter([1, 2])
+        registry.gauge('masss_read', 'read when scraped', function=lambda: next(values))
+        self.assertEqual(registry.prometheus().splitlines(),
+                         ['# HELP masss_level a level', '# TYPE masss_level gauge', 'masss_level 0.5',
+                          '# HELP masss_read read when scraped', '# TYPE masss_read gauge', 'masss_read 1'])
+        self.assertEqual(registry.snapshot()['metrics']['masss_read']['values'], [{'value': 2}])
+
+    def test_histogram(self):
+        registry = Registry()
+        histogram = registry.histogram('masss_seconds', 'durations', ['path'], buckets=(1, 0.125))
+        for value in (0.0625, 0.5, 0.75, 4):
+            histogram.labels('idle').observe(value)
+        self.assertEqual(registry.prometheus().splitlines()[2:],
+                         ['masss_seconds_bucket{path="idle",le="0.125"} 1',
+                          'masss_seconds_bucket{path="idle",le="1"} 3',  # cumulative
+                          'masss_seconds_bucket{path="idle",le="+Inf"} 4',
+                          'masss_seconds_sum{path="idle"} 5.3125',
+                          'masss_seconds_count{path="idle"} 4'])
+
+
+if __name__ == '__main__':
+    unittest.main()
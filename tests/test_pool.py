@@ -0,0 +1,104 @@
+#!/bin/false
+
+# InstancePool: voice handles, and the choice of the idle instances
+
+import unittest
+from pool import InstancePool, Handle
+
+
+class Inst:
+    """stands for an instance: the pool only uses these two attributes"""
+    def __init__(self, is_dirty=False):
+        self.slot = None
+        self.is_dirty = is_dirty
+
+
+class TestHandles(unittest.TestCase):
+    def setUp(self):
+        self.pool = InstancePool()
+        self.inst = Inst()
+        self.pool.add(self.inst)
+
+    def test_acquire(self):
+        handle = self.pool.acquire()
+        self.assertEqual(handle.slot, self.inst.slot)
+        self.assertIs(self.pool.get(handle), self.inst)
+        self.assertEqual(self.pool.count_idle(), 0)
+        self.assertIsNone(self.pool.acquire())  # nothing idle anymore
+
+    def test_released_handle_is_stale(self):
+        old = self.pool.acquire()
+        self.pool.release(self.inst)
+        self.assertIsNone(self.pool.get(old))
+        self.assertEqual(self.pool.count_idle(), 1)
+        # the same instance plays another voice: the old handle still doesn't reach it
+        new = self.pool.acquire()
+        self.assertIsNone(self.pool.get(old))
+        self.assertIs(self.pool.get(new), self.inst)
+        self.assertNotEqual(old, new)
+
+    def test_removed_handle_is_stale(self):
+        old = self.pool.acquire()
+        self.pool.remove(self.inst)
+        self.assertIsNone(self.pool.get(old))
+        self.assertIsNone(self.inst.slot)
+        self.assertEqual(len(self.pool), 0)
+        # the slot is reused by the next instance
+        other = Inst()
+        self.pool.add(other)
+        self.assertEqual(other.slot, old.slot)
+        self.assertIsNone(self.pool.get(old))
+        self.assertIs(self.pool.get(self.pool.acquire()), other)
+
+    def test_release_after_remove(self):
+        self.pool.acquire()
+        self.pool.remove(self.inst)
+        self.pool.release(self.inst)  # the track stopped after its instance broke: nothing happens
+        self.assertEqual(len(self.pool), 0)
+        self.assertEqual(self.pool.count_idle(), 0)
+
+    def test_bad_handles(self):
+        self.pool.acquire()
+        for handle in (None, ('mixer', 1), Handle(5, 1), Handle(-1, 1), Handle(self.inst.slot, 0)):
+            self.assertIsNone(self.pool.get(handle))
+
+
+class TestIdle(unittest.TestCase):
+    def test_acquire_prefers_clean_and_warm(self):
+        pool = InstancePool()
+        dirty, first, last = Inst(is_dirty=True), Inst(), Inst()
+        for inst in (dirty, first, last):
+            pool.add(inst)
+        self.assertIs(pool.get(pool.acquire()), last)
+        self.assertIs(pool.get(pool.acquire()), first)
+        self.assertIs(pool.get(pool.acquire()), dirty)
+
+    def test_pop_idle_prefers_dirty(self):
+        pool = InstancePool()
+        clean, dirty = Inst(), Inst(is_dirty=True)
+        pool.add(clean)
+        pool.add(dirty)
+        self.assertIs(pool.first_idle_dirty(), dirty)
+        self.assertIs(pool.pop_idle(), dirty)
+        self.assertNotIn(dirty, pool)
+        self.assertIs(pool.pop_idle(), clean)
+        self.assertIsNone(pool.pop_idle())
+
+    def test_mark_dirty(self):
+        pool = InstancePool()
+        inst = Inst()
+        pool.add(inst)
+        inst.is_dirty = True
+        pool.mark_dirty(inst)
+        self.assertEqual(pool.count_idle(clean_only=True), 0)
+        self.assertEqual(pool.count_idle_dirty(), 1)
+        # a playing instance becomes idle again with its own state
+        handle = pool.acquire()
+        inst.is_dirty = False
+        pool.release(pool.get(handle))
+        self.assertEqual(pool.count_idle(clean_only=True), 1)
+        self.assertIsNone(pool.first_idle_dirty())
+
+
+if __name__ == '__main__':
+    unittest.main()
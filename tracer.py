@@ -0,0 +1,136 @@
+#!/bin/false
+
+# optional trace of what happens for each button press, to find where the time goes when a press is slow.
+# the work of a press is spread over Tk's thread (the button), the event loop (play(), the instance, the rc commands,
+# the pool cleaning) and vlc's answers: each press gets an id, and every span recorded for it carries that id.
+# the trace is saved in chrome's trace-event format: open it in https://ui.perfetto.dev or chrome://tracing.
+# the spans of a press are async events with the press' id, so they are shown together on one track.
+#
+# the tracer is off unless MASSS is started with --trace. when it is off, recording does nothing.
+# events can be recorded from any thread (deque appends are atomic).
+
+import os
+import json
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager
+from time import perf_counter
+
+try:
+    import contextvars
+except ImportError:  # python < 3.7: the press ids are only known where they are passed explicitly
+    contextvars = None
+
+MAX_EVENTS = 1000000  # older events are forgotten
+
+
+class _NoContextVar:
+    def get(self):
+        return None
+
+    def set(self, value):
+        pass
+
+# the id of the press being handled by the current task (set by VlcInterface.play).
+# asyncio tasks have their own copy: the id follows a press through the coroutines it awaits
+# (and the tasks they create: see VlcInterface.add_task for the background ones)
+current_press = contextvars.ContextVar('current_press', default=None) if contextvars else _NoContextVar()
+
+
+def timestamp():
+    """in microseconds, as chrome wants them"""
+    return perf_counter() * 1e6
+
+
+class Tracer:
+    def __init__(self):
+        self.events = None  # deque of trace events, once started
+        self.path = None
+        self.pid = os.getpid()
+        self.press_ids = itertools.count(1)
+        self.threads = {}  # thread id -> name
+
+    @property
+    def is_enabled(self):
+        return self.events is not None
+
+    def start(self, path, max_events=MAX_EVENTS):
+        self.path = path
+        self.events = deque(maxlen=max_events)
+
+    def new_press(self):
+        """a new correlation id, for a press. None if the tracer is off"""
+        if self.events is None:
+            return None
+        return next(self.press_ids)
+
+    def _event(self, phase, name, press, ts, args, dur=None):
+        tid = threading.get_ident()
+        if tid not in self.threads:
+            self.threads[tid] = threading.current_thread().name
+        event = {'name': name, 'ph': phase, 'ts': ts, 'pid': self.pid, 'tid': tid}
+        if dur is not None:
+            event['dur'] = dur
+        if press is not None:
+            event['cat'] = 'press'
+            event['id'] = press
+            args = dict(args, press=press)
+        else:
+            event['cat'] = 'masss'
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    # ## recording. `press` is the press' id (the current one if None). spans without a press are thread spans
+    def begin(self, name, press=None, **args):
+        """starts a span. returns a token for end(), or None if the tracer is off"""
+        if self.events is None:
+            return None
+        if press is None:
+            press = current_press.get()
+        ts = timestamp()
+        if press is not None:
+            self._event('b', name, press, ts, args)
+        return (name, press, ts, args)
+
+    def end(self, token, **args):
+        if token is None or self.events is None:
+            return
+        name, press, beg, begin_args = token
+        if press is not None:
+            self._event('e', name, press, timestamp(), args)
+        else:
+            self._event('X', name, None, beg, dict(begin_args, **args), timestamp() - beg)
+
+    @contextmanager
+    def span(self, name, press=None, **args):
+        token = self.begin(name, press, **args)
+        try:
+            yield
+        finally:
+            self.end(token)
+
+    def instant(self, name, press=None, **args):
+        if self.events is None:
+            return
+        if press is None:
+            press = current_press.get()
+        self._event('n' if press is not None else 'i', name, press, timestamp(), args)
+
+    # ## saving
+    def save(self):
+        if self.events is None:
+            return
+        events = list(self.events)
+        events += [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}}
+                   for tid, name in list(self.threads.items())]
+        try:
+            with open(self.path+'.tmp', 'w') as file:
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+            os.replace(self.path+'.tmp', self.path)
+            print('trace saved to', self.path)
+        except OSError as err:
+            print('warning: could not save the trace:', err)
+
+TRACER = Tracer()
@@ -0,0 +1,162 @@
+#!/bin/false
+
+# watches the sounds directory, and keeps the library index (and the UI) up to date while MASSS runs.
+# on linux, the kernel tells us about changes (inotify). elsewhere, the directories are checked every few seconds.
+# changes come in bursts (copying a folder creates many files): they are gathered, and the index is updated once
+# the burst is over. the directories are read in a worker thread, so that slow disks don't freeze the UI.
+
+import os
+import sys
+import struct
+import ctypes
+import ctypes.util
+from time import monotonic as time
+
+# inotify constants (from <sys/inotify.h>)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE \
+             | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len (followed by the name)
+
+
+def load_inotify():
+    """returns libc if it has inotify, None otherwise"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class SoundsWatcher:
+    def __init__(self, library, loop, on_change=None, delay=0.5, max_delay=3.0, poll_interval=2.0):
+        """`on_change(reldirs)` is called with the set of the directories whose listing changed.
+        changes are gathered until nothing happened for `delay` seconds (but not longer than `max_delay`)"""
+        self.library = library
+        self.loop = loop
+        self.on_change = on_change
+        self.delay = delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+
+        self.libc = None
+        self.fd = None  # the inotify file descriptor, if inotify is used
+        self.watches = {}  # watch descriptor -> directory (relative to the library root)
+        self.pending = set()  # directories which got events since the last update
+        self.first_event_time = None  # time of the first event of the current burst
+        self.handle = None  # the timer of the next update
+        self.update_task = None
+        self.is_closed = False
+
+    def start(self):
+        self.libc = load_inotify()
+        if self.libc is not None:
+            fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd >= 0:
+                self.fd = fd
+                self.add_watches()
+                self.loop.add_reader(self.fd, self.onReadable)
+                return
+            print('warning: inotify unavailable ({:s}), checking the sounds directory every {:g} seconds'.format(
+                  os.strerror(ctypes.get_errno()), self.poll_interval))
+        self.handle = self.loop.call_later(self.poll_interval, self.startUpdate)
+
+    def close(self):
+        self.is_closed = True
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        if self.fd is not None:
+            self.loop.remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = None
+        if self.update_task is not None:
+            self.update_task.cancel()
+
+    def add_watches(self):
+        """watches the directories of the library which are not watched yet, and forgets the removed ones"""
+        for wd, reldir in list(self.watches.items()):
+            if reldir not in self.library.dirs:  # removed, or moved away
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+        watched = set(self.watches.values())
+        for reldir in list(self.library.dirs):
+            if reldir in watched:
+                continue
+            path = os.fsencode(self.library.path(reldir))
+            wd = self.libc.inotify_add_watch(self.fd, path, WATCH_MASK)
+            if wd < 0:
+                print('warning: cannot watch', self.library.path(reldir), ':', os.strerror(ctypes.get_errno()))
+            else:
+                self.watches[wd] = reldir
+
+    def onReadable(self):
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:  # events were lost: read everything again
+                self.pending.update(self.library.dirs)
+            reldir = self.watches.get(wd)
+            if reldir is None:
+                continue
+            if mask & IN_IGNORED:  # the directory is gone (or moved): its watch was removed
+                del self.watches[wd]
+            self.pending.add(reldir)
+        self.schedule()
+
+    def schedule(self):
+        """(re)starts the timer of the next update: waits for the end of the burst"""
+        now = time()
+        if self.first_event_time is None:
+            self.first_event_time = now
+        if self.handle is not None:
+            self.handle.cancel()
+        wait = min(self.delay, self.first_event_time + self.max_delay - now)
+        self.handle = self.loop.call_later(max(0, wait), self.startUpdate)
+
+    def startUpdate(self):
+        self.handle = None
+        if self.is_closed:
+            return
+        if self.update_task is not None and not self.update_task.done():
+            # still reading the last changes: try again later
+            self.handle = self.loop.call_later(self.delay, self.startUpdate)
+            return
+        self.update_task = self.loop.create_task(self.update())
+
+    async def update(self):
+        reread, self.pending = self.pending, set()
+        self.first_event_time = None
+        try:
+            changed = await self.loop.run_in_executor(None, self.library.scan, reread)
+        except OSError as err:
+            print('warning: cannot read the sounds directory:', err)
+            changed = set()
+        if self.is_closed:
+            return
+        if changed:
+            await self.loop.run_in_executor(None, self.library.save)
+            if self.fd is not None:
+                self.add_watches()  # new directories
+            if self.on_change is not None:
+                self.on_change(changed)
+        if self.fd is None:  # polling
+            self.handle = self.loop.call_later(self.poll_interval, self.startUpdate)